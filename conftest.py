@@ -0,0 +1,12 @@
+import pytest
+from stand_in_remote import StandInRemote
+
+@pytest.fixture
+def stand_in_remote(tmp_path):
+    '''
+    A StandInRemote serving the repositories created in its root directory, without
+    network conditions until the test sets them.
+    '''
+    remote = StandInRemote(str(tmp_path / 'remotes')).start()
+    yield remote
+    remote.stop()
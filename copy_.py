@@ -1,5 +1,8 @@
 from git import Repo
-import os, shutil, argparse, sys
+from git.exc import GitCommandError
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import os, shutil, argparse, sys, json, time, fcntl, tempfile, re, threading, atexit, signal, subprocess, errno, hashlib
 #from colorama import Fore
 
 '''
@@ -23,7 +26,12 @@ DESCRIPTION
     (See https://docs.travis-ci.com/user/environment-variables/#default-environment-variables)
     
     The module use argparse to allow command-line arguments. Run 'python copy_.py --help'
-    for more information.
+    for more information. The commands in COMMANDS are run as 'python copy_.py COMMAND', 
+    for example 'python copy_.py maintain --help'.
+
+        bundle: create or refresh the git bundles that seed the clones.
+        maintain: maintenance tasks for long-lived clones.
+        prefetch: fetch the objects of the branches before the build needs them.
 
     Use GitPython module to execute the git commands and handle the repository. 
     See https://gitpython.readthedocs.io/en/stable/ for more information about that module.
@@ -32,27 +40,68 @@ DESCRIPTION
     information.
 
 FUNCTIONS:
+    bundle
+    copy_file
+    copy_tree
+    create_bundle
+    get_bundle_parse_args
+    get_config_env
     get_env_var
+    get_maintain_parse_args
+    get_merge_base_ref
     get_parse_args
+    get_prefetch_paths
+    get_url_host
+    is_build_repository
+    is_ssh_url
     main
+    maintain
+    maintain_repository
+    parse_timeout
+    prefetch
+    prefetch_repository
     print_colored
+    read_lock_file
+    time_repository
     validate_args
+    write_json
+    write_lock_file
         
 CLASSES:
+    EventLog
+    GitWatchdog
+    HostGovernor
+    TrashCollector
     TravisRepoAction
 
 GLOBAL VARIABLES:
+    COMMANDS
+    COPY_MODES
     DEFAULT_BRANCH
+    DEFAULT_BUNDLE_MAX_AGE
+    DEFAULT_COPY_WORKERS
+    DEFAULT_DELETE_WORKERS
+    DEFAULT_MAX_PER_HOST
+    DEFAULT_SUBMODULE_JOBS
+    LOG
+    EMPTY_TREE_SHA
+    FICLONE
+    LOCK_COMMIT_KEYS
+    TRAVIS_COMMIT_RANGE
     TRAVIS_ORIGIN_ENV_NAME
     TRAVIS_PULL_REQUEST
+    TRAVIS_REPO_SLUG
     TRAVIS_TARGET_ENV_NAME
     TRAVIS_TYPE_PR
     TRAVIS_TYPE_PUSH
+    TRASH
 
 EXCEPTIONS:
     ActionTypeError(Exception)
     DefaultBranchNotExists(Exception)
     DefaultBranchNotFound(Exception)
+    GitTimeout(Exception)
+    LockFileError(Exception)
     MergeError(Exception)
     NotTargetNorOrigin(Exception)
 '''
@@ -61,9 +110,21 @@ EXCEPTIONS:
 TRAVIS_PULL_REQUEST = 'TRAVIS_PULL_REQUEST'
 TRAVIS_ORIGIN_ENV_NAME = 'TRAVIS_PULL_REQUEST_BRANCH'
 TRAVIS_TARGET_ENV_NAME = 'TRAVIS_BRANCH'
+TRAVIS_COMMIT_RANGE = 'TRAVIS_COMMIT_RANGE'
+TRAVIS_REPO_SLUG = 'TRAVIS_REPO_SLUG'
 TRAVIS_TYPE_PR = 'pr'
 TRAVIS_TYPE_PUSH = 'push'
 DEFAULT_BRANCH = os.getenv('DEFAULT_BRANCH')
+DEFAULT_SUBMODULE_JOBS = 4
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_DELETE_WORKERS = 8
+DEFAULT_BUNDLE_MAX_AGE = 7
+DEFAULT_COPY_WORKERS = 8
+COPY_MODES = ['auto', 'hardlink', 'copy']
+# ioctl request of Linux to share the extents of a file (copy-on-write clone)
+FICLONE = 0x40049409
+LOCK_COMMIT_KEYS = ['target_ref', 'target', 'tag', 'origin', 'merge', 'merge_tree']
+EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
 
 if not DEFAULT_BRANCH:
     DEFAULT_BRANCH = 'master'
@@ -82,6 +143,18 @@ class NotTargetNorOrigin(Exception):
     pass
 
 class MergeError(Exception):
+    '''
+    The details attribute stores the outcome of each origin branch merged, see the 
+    TravisRepoAction merge_results attribute.
+    '''
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details or []
+
+class LockFileError(Exception):
+    pass
+
+class GitTimeout(Exception):
     pass
 
 # Define Classes
@@ -97,13 +170,41 @@ class TravisRepoAction():
             If is True clone the repository from url to path when instance the object.
         target_branch: str, default None.
             The target branch name.
-        origin_branch: str, default None.
-            The origin branch name.
+        origin_branch: str or list(str), default None.
+            The origin branch name, or the names of the origin branches merged in order.
         default_branch: str, default 'master'.
             The default branch name.
         action_type: str, default 'push'.
             The travis action type. Only accept 'push' and 'pr' values, otherwise
             raise ActionTypeError.
+        submodules: bool, default False.
+            If is True initialize the submodules after the final commit is checked out.
+        submodule_jobs: int, default DEFAULT_SUBMODULE_JOBS.
+            The number of submodules fetched concurrently.
+        shallow_submodules: bool, default True.
+            If is True fetch only the commit recorded for each submodule (depth 1).
+        governor: class HostGovernor, default None.
+            The limiter of the network operations per host. If None, use a HostGovernor 
+            with the default values.
+        checkout_workers: int, default None.
+            The number of parallel workers that write the files on checkout and merge. 
+            If 0, use one worker per available core. If None, git writes them serially.
+        trash: class TrashCollector, default None.
+            The service that deletes the directories in background. If None, use TRASH.
+        seed_bundle: str, default None.
+            A git bundle file, or a directory with '<path>.bundle' files (see the 
+            'bundle' command), to seed the clone before fetching from url.
+        bundle_max_age: float, default DEFAULT_BUNDLE_MAX_AGE.
+            The maximum age in days of the seed bundle. Older bundles are not used.
+        watchdog: class GitWatchdog, default None.
+            The runner of the clone, fetch, checkout and merge git commands. If None, 
+            use a GitWatchdog without timeouts.
+        prefetch_store: str, default None.
+            The directory where the 'prefetch' command fetched the objects. If the 
+            prefetch of url covers the branches, clone from it without network.
+        octopus: bool, default False.
+            If is True merge all the origin branches in a single octopus merge, else 
+            merge them one by one.
     
     Attributes:
         url: str.
@@ -112,14 +213,46 @@ class TravisRepoAction():
             Store the path where the repository will be cloned.
         target_branch: str, None.
             Store the target branch name.
-        origin_branch: str, None.
-            Store the origin branch name.
+        origin_branch: str, list(str), None.
+            Store the origin branch name or names.
         default_branch: str.
             Store the default branch name.
         action_type: str.
             Store the travis action type.
+        submodules: bool.
+            Store if the submodules must be initialized.
+        submodule_jobs: int.
+            Store the number of submodules fetched concurrently.
+        shallow_submodules: bool.
+            Store if the submodules are fetched with depth 1.
+        governor: class HostGovernor.
+            Store the limiter of the network operations (clone and fetch) per host.
+        checkout_workers: int, None.
+            Store the number of parallel checkout workers.
+        stats: dict.
+            Store the 'files' written and the 'seconds' spent by 'checkout' and 'merge'.
+        trash: class TrashCollector.
+            Store the service that deletes the directories in background.
+        seed_bundle: str, None.
+            Store the bundle file or directory to seed the clone.
+        bundle_max_age: float.
+            Store the maximum age in days of the seed bundle.
+        watchdog: class GitWatchdog.
+            Store the runner of the git commands with per-phase timeouts.
+        prefetch_store: str, None.
+            Store the directory of the prefetched repositories.
+        octopus: bool.
+            Store if the origin branches are merged in a single octopus merge.
+        merge_results: list(dict).
+            Store the outcome of each origin branch merged: the 'branch', its 'sha', 
+            the 'status' ('merged', 'missing' or 'conflict'), and for conflicts the 
+            conflicting 'files' and the git 'error'.
         repo: class Repo, None.
             Store the class git.Repo of the repository cloned from url.
+        resolved_commits: dict.
+            Store the commits resolved during the actions: 'target_ref' (the branch or tag 
+            checked out), 'target', 'tag', 'origin' (a list if origin_branch is a list), 
+            'merge' and 'merge_tree' SHAs.
         ACTION_TYPES: list(str).
             Class attribute. Store the travis action types allowed.
         
@@ -136,34 +269,64 @@ class TravisRepoAction():
                 target_branch=None,
                 origin_branch=None,
                 default_branch='master',
-                action_type='push'):
+                action_type='push',
+                submodules=False,
+                submodule_jobs=None,
+                shallow_submodules=True,
+                governor=None,
+                checkout_workers=None,
+                trash=None,
+                seed_bundle=None,
+                bundle_max_age=None,
+                watchdog=None,
+                prefetch_store=None,
+                octopus=False):
         
         self.url = url
+        self.prefetch_store = prefetch_store
+        self.octopus = octopus
+        self.merge_results = []
+        self.watchdog = watchdog or GitWatchdog()
+        self.governor = governor or HostGovernor()
+        self.checkout_workers = checkout_workers
+        self.stats = {}
+        self.trash = trash or TRASH
+        self.seed_bundle = seed_bundle
+        self.bundle_max_age = bundle_max_age or DEFAULT_BUNDLE_MAX_AGE
         
         if path:
             self.path = path
         else:
             self.path = self.generate_path()
         
-        if clone_repo:
-            self.clone_repository()
-        else:
-            self.repo = None
-
         self.target_branch = target_branch
         self.origin_branch = origin_branch
         self.default_branch = default_branch
         self.action_type = self.check_action_type(action_type)
+        self.submodules = submodules
+        self.submodule_jobs = submodule_jobs or DEFAULT_SUBMODULE_JOBS
+        self.shallow_submodules = shallow_submodules
+        self.resolved_commits = {}
+
+        if clone_repo:
+            self.clone_repository()
+        else:
+            self.repo = None
 
     def clone_repository(self):
         '''
         Clone a repository from the url attribute to the path attribute with the method 
         'git.Repo.clone_from' and store the class git.Repo returned in attribute repo.
+        If the url was prefetched (see find_prefetched method), clone from the prefetch 
+        store without network. Else, if there is a seed bundle (see find_seed_bundle 
+        method), clone from the bundle and fetch from url only the newer commits.
             
         Parameters:
             None.
             
         Raises:
+            GitTimeout:
+                The clone, or the fetch of a seeded clone, timed out.
             Exception:
                 The repository could not be cloned.
             
@@ -174,14 +337,27 @@ class TravisRepoAction():
         # Delete the repository, just to clone_from url and not get an error
         if os.path.exists(self.path):
             print_colored("The directory {} already exist. Will be delete.".format(self.path))
-            shutil.rmtree('/'.join([os.getcwd(), self.path]))
+            self.trash.discard(self.path)
 
         # Clone the repo
         try:
-            print_colored("Cloning {}.".format(self.url))
-            
-            # Clone the master branch
-            self.repo = Repo.clone_from(url=self.url, to_path=self.path)
+            with LOG.phase('clone', repo=self.url) as event:
+                print_colored("Cloning {}.".format(self.url))
+                
+                prefetched = self.find_prefetched()
+                if prefetched:
+                    event['seed'] = prefetched
+                    seeded = self.clone_from_seed(prefetched, fetch_delta=False)
+                else:
+                    event['seed'] = self.find_seed_bundle()
+                    seeded = event['seed'] and self.clone_from_seed(event['seed'])
+
+                # Clone the master branch
+                if not seeded:
+                    event['seed'] = None
+                    self.governor.run(self.url, self.clone_from, self.url)
+
+                event['sha'] = self.repo.head.commit.hexsha
             
             print_colored("The repository was cloned successfully.", color='GREEN')
 
@@ -189,16 +365,306 @@ class TravisRepoAction():
             print_colored("The repository could not be clone from the {0} to {1}.".format(self.url, self.path),
                         color='RED')
             print_colored(str(error), color='RED')
+            if isinstance(error, GitTimeout):
+                raise
             raise Exception()
 
+    def find_seed_bundle(self):
+        '''
+        Return the seed bundle file for the url attribute, or None if the seed_bundle 
+        attribute is None, the bundle does not exist, or it is older than bundle_max_age 
+        attribute. If seed_bundle attribute is a directory, the bundle is 
+        '<generate_path()>.bundle' in it.
+        '''
+        if not self.seed_bundle:
+            return None
+
+        bundle = self.seed_bundle
+        if os.path.isdir(bundle):
+            bundle = os.path.join(bundle, self.generate_path() + '.bundle')
+
+        if not os.path.isfile(bundle):
+            print_colored("The seed bundle {} does not exist.".format(bundle))
+            return None
+
+        age = (time.time() - os.path.getmtime(bundle)) / 86400
+        if age > self.bundle_max_age:
+            print_colored("The seed bundle {0} is stale ({1:.1f} days old).".format(bundle, age))
+            return None
+
+        return bundle
+
+    def find_prefetched(self):
+        '''
+        Return the repository prefetched for the url attribute in prefetch_store attribute, 
+        or None if there is not a complete prefetch of the target, origin and default 
+        branches attributes (see the 'prefetch' command). If the prefetch is in progress, 
+        wait until it ends.
+        '''
+        if not self.prefetch_store:
+            return None
+
+        repo_dir, marker_path, lock_path = get_prefetch_paths(self.url, self.prefetch_store)
+        if not os.path.exists(lock_path):
+            print_colored("The repository {} was not prefetched.".format(self.url))
+            return None
+
+        with open(lock_path) as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                print_colored("Waiting for the prefetch of {}.".format(self.url))
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+
+            try:
+                with open(marker_path) as marker_file:
+                    marker = json.load(marker_file)
+            except (OSError, ValueError):
+                marker = {}
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        branches = set(branch for branch in [self.target_branch, self.default_branch] + self.get_origin_branches()
+                        if branch)
+        if marker.get('state') != 'complete' or not branches.issubset(marker.get('branches', [])):
+            print_colored("The prefetch of {} does not cover the branches.".format(self.url))
+            return None
+
+        return repo_dir
+
+    def clone_from_seed(self, seed, fetch_delta=True):
+        '''
+        Clone the repository from seed, a git bundle file or a local repository, to path 
+        attribute and set url attribute as the origin url. If fetch_delta is True, fetch 
+        from url only the commits newer than the seed, and reset the branch checked out 
+        by the clone to its fetched commit.
+        Return True if the clone is seeded, or False if there is any error (the partial 
+        clone is deleted, so the caller can clone from url). A timed out fetch is raised 
+        instead, so the url that just hung is not cloned again.
+
+        Parameters:
+            seed: str.
+                The git bundle file or local repository.
+            fetch_delta: bool, default True.
+                If is True fetch the newer commits from url attribute.
+
+        Raises:
+            GitTimeout:
+                The fetch of the newer commits timed out.
+
+        Return:
+            bool.
+        '''
+        try:
+            print_colored("Seeding the clone from {}.".format(seed))
+            self.clone_from(seed)
+            self.repo.git.remote('set-url', 'origin', self.url)
+
+            if fetch_delta:
+                self.fetch('--prune', '--tags', 'origin')
+                self.governor.run(self.url, self.git, 'fetch', 'remote', 'set-head', 'origin', '--auto')
+
+                branch = self.repo.active_branch.name
+                if self.is_repo_branch(branch):
+                    self.git('checkout', 'reset', '--hard', 'origin/' + branch)
+
+            return True
+
+        except Exception as error:
+            print_colored("The clone could not be seeded from {}.".format(seed), color='RED')
+            print_colored(str(error), color='RED')
+            self.repo = None
+            if os.path.exists(self.path):
+                self.trash.discard(self.path)
+            if isinstance(error, GitTimeout):
+                raise
+            return False
+
+    def clone_from(self, source):
+        '''
+        Clone source (the url attribute or a local source) to path attribute with the 
+        watchdog attribute, and store the class git.Repo in attribute repo.
+        '''
+        def discard_partial_clone():
+            if os.path.exists(self.path):
+                self.trash.discard(self.path)
+
+        self.watchdog.run('clone', ['git', 'clone', '--progress', source, self.path], env=self.get_git_env(),
+                        before_retry=discard_partial_clone)
+        self.repo = Repo(self.path)
+        self.repo.git.update_environment(**self.get_git_env())
+
+    def git(self, phase, *args):
+        '''
+        Run the git command args in repo attribute with the watchdog attribute, under 
+        the timeouts of phase, and return its output.
+        '''
+        return self.watchdog.run(phase, ['git'] + list(args), cwd=self.repo.working_tree_dir,
+                                env=self.get_git_env())
+
+    def replay(self, lock_entry):
+        '''
+        Replay the actions recorded in lock_entry (see get_lock_entry method), fetching 
+        exactly the recorded commits with depth 1 instead of resolving the branches.
+        For PULL REQUEST, the recorded origin commits are merged into the target commit 
+        (in order, or in a single octopus merge if it was recorded so), deepening the 
+        history only until the merge bases are found, and the resulting tree is checked 
+        against the recorded one.
+
+        Parameters:
+            lock_entry: dict.
+                The entry of the lock file for the url attribute.
+
+        Raises:
+            LockFileError:
+                If the tree of the replayed merge is not the recorded one.
+            MergeError:
+                If there is an error during the merge.
+            GitTimeout:
+                A fetch, checkout or merge timed out.
+
+        Return:
+            None.
+        '''
+        if os.path.exists(self.path):
+            print_colored("The directory {} already exist. Will be delete.".format(self.path))
+            self.trash.discard(self.path)
+
+        with LOG.phase('replay', repo=self.url, ref=lock_entry['target_ref']) as event:
+            self.replay_commits(lock_entry)
+            event['sha'] = self.repo.head.commit.hexsha
+
+    def replay_commits(self, lock_entry):
+        '''
+        Fetch, checkout and merge the commits of lock_entry. See replay method.
+        '''
+        print_colored("Replaying {} from lock file.".format(self.url))
+        self.repo = Repo.init(self.path)
+        self.repo.create_remote('origin', self.url)
+        self.repo.git.update_environment(**self.get_git_env())
+        self.set_credentials()
+
+        target, origin = lock_entry['target'], lock_entry.get('origin')
+        origins = [sha for sha in (origin if isinstance(origin, list) else [origin]) if sha]
+        self.fetch('--depth', '1', 'origin', target, *origins)
+
+        if lock_entry.get('tag'):
+            self.git('checkout', 'checkout', target)
+        else:
+            self.git('checkout', 'checkout', '-b', lock_entry['target_ref'], target)
+        print_colored("Checkout {0} at {1}".format(lock_entry['target_ref'], target), color='GREEN')
+
+        if origins:
+            for sha in origins:
+                self.deepen_until_merge_base(target, sha)
+            if lock_entry.get('octopus') and len(origins) > 1:
+                merges = [['--no-ff'] + origins]
+            else:
+                merges = [[sha] for sha in origins]
+            for shas in merges:
+                try:
+                    print_colored("Merge {0} into {1}.".format(' '.join(shas), lock_entry['target_ref']))
+                    print_colored(self.git('merge', 'merge', '--no-edit', *shas))
+                except GitTimeout:
+                    raise
+                except Exception as error:
+                    raise MergeError(str(error))
+
+            if self.repo.head.commit.tree.hexsha != lock_entry['merge_tree']:
+                raise LockFileError('The replayed merge tree {0} is not the recorded {1}.'.format(
+                                    self.repo.head.commit.tree.hexsha, lock_entry['merge_tree']))
+
+        self.resolved_commits = dict((key, lock_entry.get(key)) for key in LOCK_COMMIT_KEYS)
+        self.resolved_commits['merge'] = self.repo.head.commit.hexsha
+        self.update_submodules()
+
+    def deepen_until_merge_base(self, *commits):
+        '''
+        Deepen the shallow history of commits until they have a merge base, doubling 
+        the depth fetched at each step, and fetching the whole history as last resort.
+        '''
+        depth = 32
+        while not self.has_merge_base(*commits):
+            if depth > 4096:
+                self.fetch('--unshallow', 'origin', *commits)
+                return
+            print_colored("Deepening the history {} commits to find the merge base.".format(depth))
+            self.fetch('--deepen', str(depth), 'origin', *commits)
+            depth *= 2
+
+    def fetch(self, *options):
+        '''
+        Run 'git fetch' with options in repo attribute, limited by the governor attribute 
+        and under the 'fetch' timeouts of the watchdog attribute.
+        '''
+        with LOG.phase('fetch', repo=self.url, args=list(options)):
+            return self.governor.run(self.url, self.git, 'fetch', 'fetch', '--progress', *options)
+
+    def has_merge_base(self, *commits):
+        '''
+        Return True if commits have a merge base in repo attribute, else False.
+        '''
+        try:
+            self.repo.git.merge_base(*commits)
+            return True
+        except Exception:
+            return False
+
     def del_git_file(self):
         '''
-        Delete the '.git' in the path.
+        Delete the '.git' in the path, and the '.git' files of the submodules.
+        The '.git' is moved out of the path at once and deleted in background, 
+        see TrashCollector.
         '''
+        if self.submodules:
+            for submodule_path in self.get_submodule_paths():
+                os.remove(os.path.join(os.getcwd(), self.path, submodule_path, '.git'))
+
         print_colored("Deleting the '.git'.")
-        shutil.rmtree('/'.join([os.getcwd(), self.path, '.git']))
+        with LOG.phase('delete', repo=self.url):
+            self.trash.discard(os.path.join(self.path, '.git'),
+                            trash_root=os.path.dirname(os.path.abspath(self.path)))
         print_colored("-----------------------------------\n")
 
+    def materialize(self, dests, mode='auto', workers=None):
+        '''
+        Copy the prepared tree in path attribute to each directory of dests, with the 
+        cheapest strategy of mode (see copy_tree function), and return a list with the 
+        'dest', 'strategy', 'files' and 'seconds' of each copy. The existing directories 
+        are deleted. The copies are added to stats attribute under 'materialize' key.
+        Call it after del_git_file method, so the '.git' is not copied.
+
+        Parameters:
+            dests: list(str).
+                The directories where the tree is copied.
+            mode: str, default 'auto'.
+                One of COPY_MODES.
+            workers: int, default None.
+                The number of parallel copy threads.
+
+        Return:
+            list(dict).
+        '''
+        results = []
+        for dest in dests:
+            if os.path.exists(dest):
+                print_colored("The directory {} already exist. Will be delete.".format(dest))
+                self.trash.discard(dest)
+
+            with LOG.phase('materialize', repo=self.url, dest=dest) as event:
+                start = time.time()
+                result = copy_tree(self.path, dest, mode=mode, workers=workers)
+                result.update(dest=dest, seconds=time.time() - start)
+                event.update(strategy=result['strategy'], files=result['files'])
+
+            stats = self.stats.setdefault('materialize', {'files': 0, 'seconds': 0})
+            stats['files'] += result['files']
+            stats['seconds'] += result['seconds']
+            print_colored("Materialize {0}: {1} files with {2} in {3:.2f} seconds.".format(
+                        dest, result['files'], result['strategy'], result['seconds']), color='GREEN')
+            results.append(result)
+
+        return results
+
     def generate_path(self):
         '''
         Take the url attribute and return the last name without '.git'. 
@@ -235,6 +701,186 @@ class TravisRepoAction():
         '''
         return [tag.name for tag in self.repo.tags]
 
+    def get_origin_branches(self):
+        '''
+        Return a list with the names of the origin branches, see origin_branch attribute.
+        '''
+        if isinstance(self.origin_branch, (list, tuple)):
+            return [branch for branch in self.origin_branch if branch]
+        return [self.origin_branch] if self.origin_branch else []
+
+    def resolve_ref(self, branch):
+        '''
+        Return the ref of repo attribute for branch argument, 'origin/<branch>' for a 
+        branch or 'tags/<branch>' for a tag, or None if it does not exist.
+        '''
+        if self.is_repo_branch(branch):
+            return 'origin/' + branch
+        elif self.is_repo_tag(branch):
+            return 'tags/' + branch
+        return None
+
+    def get_submodule_paths(self):
+        '''
+        Return a list with the paths (relative to path attribute) of the initialized 
+        submodules in repo attribute, including the nested ones.
+        '''
+        output = self.repo.git.submodule('foreach', '--quiet', '--recursive', 'echo $displaypath')
+        return [path for path in output.splitlines() if path]
+
+    def get_changed_files(self, base=None):
+        '''
+        Return a dict with the paths changed between the base commit and the final commit 
+        of repo attribute, computed from the git tree diff. If base is None, for PULL 
+        REQUEST the base is the target (or default) commit before the merge, and for PUSH 
+        is the previous commit (the first parent), so a push of several commits must pass 
+        the commit before the push as base. If base is not in repo attribute, all the 
+        paths are reported as changed.
+
+        Parameters:
+            base: str, default None.
+                The base commit or ref.
+
+        Return:
+            dict with keys:
+                base: str, None. The base commit (None if the final commit has not parents).
+                head: str. The final commit.
+                files: list(dict). The 'status' (A, D, M, T) and 'path' of each changed path.
+                directories: dict. The number of changed paths per top-level directory, 
+                    the files at the root are counted in '.'.
+        '''
+        head = self.repo.head.commit
+        if base:
+            try:
+                base = self.repo.commit(base).hexsha
+            except Exception:
+                print_colored("The base {} does not exist. All the paths are changed.".format(base))
+                base = None
+        elif self.action_type == TRAVIS_TYPE_PR and self.resolved_commits.get('target'):
+            base = self.resolved_commits['target']
+        elif head.parents:
+            base = head.parents[0].hexsha
+        else:
+            base = None
+
+        output = self.repo.git.diff_tree('-r', '-z', '--no-renames', '--name-status',
+                                        base or EMPTY_TREE_SHA, head.hexsha)
+        fields = [field for field in output.split('\0') if field]
+
+        files, directories = [], {}
+        for status, path in zip(fields[::2], fields[1::2]):
+            files.append({'status': status, 'path': path})
+            directory = path.split('/')[0] if '/' in path else '.'
+            directories[directory] = directories.get(directory, 0) + 1
+
+        return {'base': base, 'head': head.hexsha, 'files': files, 'directories': directories}
+
+    def get_tree_manifest(self):
+        '''
+        Return a dict with the object SHAs of the final commit tree of repo attribute, 
+        read from 'git ls-tree' without reading the files of the working tree.
+        The tree SHA of a directory changes if any path below it changes, so it can be used 
+        as cache key of that subtree.
+
+        Parameters:
+            None.
+
+        Return:
+            dict with keys:
+                commit: str. The final commit.
+                blobs: dict. The blob SHA of each file path.
+                trees: dict. The tree SHA of each directory path, the root is '.'.
+                submodules: dict. The commit SHA recorded for each submodule path.
+        '''
+        head = self.repo.head.commit
+        manifest = {'commit': head.hexsha, 'blobs': {}, 'trees': {'.': head.tree.hexsha}, 'submodules': {}}
+        kinds = {'blob': 'blobs', 'tree': 'trees', 'commit': 'submodules'}
+
+        output = self.repo.git.ls_tree('-r', '-t', '-z', '--full-tree', head.hexsha)
+        for line in output.split('\0'):
+            if line:
+                info, path = line.split('\t', 1)
+                mode, kind, sha = info.split()
+                manifest[kinds[kind]][path] = sha
+
+        return manifest
+
+    def get_git_env(self):
+        '''
+        Return a dict with the environment variables for the git commands of repo attribute: 
+        the connection reuse of the governor attribute, and the 'checkout.workers' 
+        configuration if checkout_workers attribute is not None (git only writes in 
+        parallel when at least 'checkout.thresholdForParallelism' files, 100 by default, 
+        change). The configuration is passed as environment so it also applies to the 
+        checkout done by the clone.
+        '''
+        env = self.governor.get_env(self.url)
+        if self.checkout_workers is not None:
+            env.update(get_config_env({
+                'checkout.workers': self.checkout_workers or os.cpu_count() or 1,
+            }))
+        return env
+
+    def count_changed_files(self, old_commit, new_commit):
+        '''
+        Return the number of paths that differ between old_commit and new_commit.
+        '''
+        output = self.repo.git.diff('--name-only', '-z', '--no-renames', old_commit, new_commit)
+        return len([path for path in output.split('\0') if path])
+
+    def run_timed(self, name, ref, operation, *args):
+        '''
+        Call operation, a git command that updates the working tree to ref, with args and 
+        return its result. Add to stats attribute the files written and the seconds spent, 
+        under name key, and log them as the phase name.
+        '''
+        with LOG.phase(name, repo=self.url, ref=ref) as event:
+            old_commit = self.repo.head.commit.hexsha
+            start = time.time()
+            result = operation(*args)
+            seconds = time.time() - start
+            event['sha'] = self.repo.head.commit.hexsha
+            event['files'] = files = self.count_changed_files(old_commit, event['sha'])
+
+        stats = self.stats.setdefault(name, {'files': 0, 'seconds': 0})
+        stats['files'] += files
+        stats['seconds'] += seconds
+        print_colored("{0}: {1} files in {2:.2f} seconds.".format(name.capitalize(), files, seconds))
+        return result
+
+    def get_lock_entry(self):
+        '''
+        Return a dict with the branches names and the commits resolved by the actions 
+        (see resolved_commits attribute), to be recorded in a lock file.
+        '''
+        entry = {
+            'action_type': self.action_type,
+            'target_branch': self.target_branch,
+            'origin_branch': self.origin_branch,
+            'default_branch': self.default_branch,
+            'octopus': self.octopus,
+        }
+        for key in LOCK_COMMIT_KEYS:
+            entry[key] = self.resolved_commits.get(key)
+        return entry
+
+    def record_target(self, ref):
+        '''
+        Store in resolved_commits attribute the commit checked out for the target ref, 
+        a branch or a tag.
+        '''
+        sha = self.repo.head.commit.hexsha
+        self.resolved_commits['target_ref'] = ref
+        self.resolved_commits['target'] = sha
+        self.resolved_commits['tag'] = sha if not self.is_repo_branch(ref) else None
+
+    def record_result(self):
+        '''
+        Store in resolved_commits attribute the final commit and tree of repo attribute.
+        '''
+        self.resolved_commits['merge'] = self.repo.head.commit.hexsha
+        self.resolved_commits['merge_tree'] = self.repo.head.commit.tree.hexsha
+
     def is_repo_branch(self, branch):
         '''
         Return True if branch argument is a branch of repo attribute, else False.
@@ -338,7 +984,7 @@ class TravisRepoAction():
         print_colored("Repository url:         {}".format(self.url))
         print_colored("Travis action type:     {}".format(self.action_type))
         print_colored("-----------------------------------")
-        print_colored("Origin branch:          {}".format(self.origin_branch))
+        print_colored("Origin branch:          {}".format(', '.join(self.get_origin_branches()) or None))
         print_colored("Target branch:          {}".format(self.target_branch))
         print_colored("Default branch:         {}".format(self.default_branch))
         print_colored("-----------------------------------\n")
@@ -365,59 +1011,180 @@ class TravisRepoAction():
             bool.
         '''
         if self.is_repo_branch(branch):
-            self.repo.git.checkout(branch)
+            self.run_timed('checkout', branch, self.git, 'checkout', 'checkout', branch)
             print_colored("Checkout " + str(self.repo.active_branch), color='GREEN')
             return True
         elif self.is_repo_tag(branch):
-            self.repo.git.checkout('tags/' + branch)
+            self.run_timed('checkout', branch, self.git, 'checkout', 'checkout', 'tags/' + branch)
             print_colored("Checkout tags/{}".format(branch), color='GREEN')
             return True
         
         return False
 
+    def update_submodules(self):
+        '''
+        Initialize and update the submodules of the commit checked out in repo attribute, 
+        fetching submodule_jobs submodules concurrently. If shallow_submodules attribute 
+        is True, only the commit recorded in the superproject is fetched (depth 1).
+        Must be called once merge or checkout have settled the final commit, so the 
+        submodules of discarded trees are never fetched.
+        Return True if the submodules were updated, else False.
+
+        Parameters:
+            None.
+
+        Return:
+            bool.
+        '''
+        if not self.submodules:
+            return False
+
+        if not os.path.exists(os.path.join(self.repo.working_tree_dir, '.gitmodules')):
+            print_colored("The repository has not submodules.")
+            return False
+
+        options = ['update', '--init', '--recursive', '--jobs', str(self.submodule_jobs)]
+        if self.shallow_submodules:
+            options.extend(['--depth', '1'])
+
+        print_colored("Updating submodules with {} jobs.".format(self.submodule_jobs))
+        with LOG.phase('submodules', repo=self.url, sha=self.repo.head.commit.hexsha):
+            self.governor.run(self.url, self.git, 'fetch', 'submodule', *options)
+        print_colored("The submodules were updated successfully.", color='GREEN')
+        return True
+
     def merge(self):
         '''
-        Merge the origin_branch attribute into the target_branch attribute and return True.
-        If the target_branch attribute is not in the repo attribute, merge into the 
-        default_branch attribute and return True.
-        If the origin_branch attribute is not in the repo attribute, checkout to target_branch 
+        Merge the origin branches (see get_origin_branches method) into the target_branch 
+        attribute and return True. If the target_branch attribute is not in the repo 
+        attribute, merge into the default_branch attribute and return True.
+        The target is checked out once, and the origin branches are merged in order, or 
+        in a single octopus merge if octopus attribute is True. The outcome of each 
+        origin branch is stored in merge_results attribute.
+        If none of the origin branches are in the repo attribute, checkout to target_branch 
         attribute or default_branch and return False.
-        If there is any error with 'git.merge', for example merge conflics, raise MergeError.
+        If there is any error with 'git merge', for example merge conflicts, raise 
+        MergeError once all the origin branches were tried. A conflicting merge is aborted, 
+        so the next origin branches are merged on top of the previous ones.
 
         Parameters:
             None.
 
         Raises:
             MergeError:
-                If there is an error during the merge, like Merge Conflicts.
+                If there is an error during the merge, like Merge Conflicts. The details 
+                attribute has the merge_results attribute.
+            GitTimeout:
+                The merge timed out.
 
         Return:
             bool.
         '''
-        # Try checkout to origin like 'git checkout origin'
-        o_check = self.checkout(self.origin_branch)
-        # Try checkout to target like 'git checkout target'    
+        self.merge_results = []
+        refs = []
+        for branch in self.get_origin_branches():
+            ref = self.resolve_ref(branch)
+            sha = self.repo.commit(ref).hexsha if ref else None
+            self.merge_results.append({'branch': branch, 'sha': sha, 'status': 'missing' if not ref else None})
+            if ref:
+                refs.append(ref)
+
+        shas = [result['sha'] for result in self.merge_results]
+        if isinstance(self.origin_branch, (list, tuple)):
+            self.resolved_commits['origin'] = shas
+        else:
+            self.resolved_commits['origin'] = shas[0] if shas else None
+
+        # Try checkout to target like 'git checkout target'
         t_check = self.checkout(self.target_branch)
 
         if not t_check:
             self.checkout(self.default_branch)
 
-        if o_check:
-            try:
-                print_colored("Merge {0} into {1}.".format(self.origin_branch, self.repo.active_branch))
-                response = self.repo.git.merge(self.origin_branch)
-                # This print out all the message about the merge.
-                print_colored(response)
-                return True
-            except Exception as error:
-                raise MergeError(str(error))
-                #print_colored(str(error), color='RED')
-        else:
-            print_colored("The origin branch: {} does not exist.".format(self.origin_branch))
+        self.record_target(self.target_branch if t_check else self.default_branch)
+
+        for result in self.merge_results:
+            if result['status'] == 'missing':
+                print_colored("The origin branch: {} does not exist.".format(result['branch']))
+
+        if not refs:
             print_colored("Not need to merge.")
-            pass
+            return False
 
-        return False
+        if self.octopus and len(refs) > 1:
+            self.merge_octopus(refs)
+        else:
+            for ref, result in zip(refs, [result for result in self.merge_results if result['status'] != 'missing']):
+                self.merge_ref(ref, result)
+
+        conflicts = [result for result in self.merge_results if result['status'] == 'conflict']
+        if conflicts:
+            raise MergeError('\n'.join('{0}: {1}'.format(result['branch'], result['error']) for result in conflicts),
+                            self.merge_results)
+
+        return True
+
+    def merge_ref(self, ref, result):
+        '''
+        Merge ref into the active branch of repo attribute, and store the outcome in 
+        result (see merge_results attribute). If the merge fails, it is aborted, but a 
+        GitTimeout of the merge is raised.
+        Return True if ref was merged, else False.
+        '''
+        try:
+            print_colored("Merge {0} into {1}.".format(result['branch'], self.repo.active_branch))
+            response = self.run_timed('merge', result['branch'], self.git, 'merge', 'merge', '--no-edit', ref)
+            # This print out all the message about the merge.
+            print_colored(response)
+            result['status'] = 'merged'
+            return True
+        except GitTimeout:
+            raise
+        except Exception as error:
+            result.update(status='conflict', error=str(error), files=self.get_conflict_files())
+            print_colored("The merge of {} failed.".format(result['branch']), color='RED')
+            self.git('merge', 'reset', '--merge')
+            return False
+
+    def merge_octopus(self, refs):
+        '''
+        Merge refs into the active branch of repo attribute in a single octopus merge 
+        commit, never fast-forwarded. If it fails, reset to the target commit and merge 
+        refs one by one to find the conflicting origin branches, then reset again to the 
+        target commit, so the outcome of each origin branch is stored in merge_results 
+        attribute. A GitTimeout of the merge is raised, not retried one by one.
+        '''
+        results = [result for result in self.merge_results if result['status'] != 'missing']
+        names = ' '.join(result['branch'] for result in results)
+        try:
+            print_colored("Octopus merge {0} into {1}.".format(names, self.repo.active_branch))
+            print_colored(self.run_timed('merge', names, self.git, 'merge', 'merge', '--no-edit', '--no-ff', *refs))
+            for result in results:
+                result['status'] = 'merged'
+            return
+        except GitTimeout:
+            raise
+        except Exception as error:
+            print_colored("The octopus merge failed, merging one by one to find the conflicts.", color='RED')
+            octopus_error = str(error)
+
+        target = self.resolved_commits['target']
+        self.git('merge', 'reset', '--hard', target)
+        for ref, result in zip(refs, results):
+            self.merge_ref(ref, result)
+        self.git('merge', 'reset', '--hard', target)
+
+        # The octopus strategy refuses some merges that are clean one by one
+        if not any(result['status'] == 'conflict' for result in results):
+            for result in results:
+                result.update(status='conflict', error=octopus_error, files=[])
+
+    def get_conflict_files(self):
+        '''
+        Return a list with the paths with merge conflicts in repo attribute.
+        '''
+        output = self.repo.git.diff('--name-only', '-z', '--diff-filter=U')
+        return [path for path in output.split('\0') if path]
 
     def pr(self):
         '''
@@ -426,6 +1193,7 @@ class TravisRepoAction():
             -Check the default_branch attribute.
             -Print the input data.
             -Merge the origin_branch attirbute into the target_branch attribute.
+            -Update the submodules if submodules attribute is True.
         
         See merge method.
 
@@ -441,7 +1209,11 @@ class TravisRepoAction():
         self.check_default_branch(self.default_branch)
         self.print_input_data()
 
-        return self.merge()
+        merged = self.merge()
+        self.record_result()
+        self.update_submodules()
+
+        return merged
 
     def push(self):
         '''
@@ -451,6 +1223,7 @@ class TravisRepoAction():
             -Print the input data.
             -Checkout to target_branch attirbute if exists, else checkout to 
              default_branch attribute.
+            -Update the submodules if submodules attribute is True.
 
         Parameters:
             None
@@ -468,9 +1241,16 @@ class TravisRepoAction():
         self.print_input_data()
 
         if self.checkout(self.target_branch):
-            return True
-        
-        return self.checkout(self.default_branch)      
+            checked = True
+            self.record_target(self.target_branch)
+        else:
+            checked = self.checkout(self.default_branch)
+            self.record_target(self.default_branch)
+
+        self.record_result()
+        self.update_submodules()
+
+        return checked
 
     def run(self):
         '''
@@ -500,22 +1280,611 @@ class TravisRepoAction():
         else:
             raise ActionTypeError("The 'action_type' must be {}".format(' or '.join(TravisRepoAction.ACTION_TYPES)))
 
-# Define Functions
-def print_colored(string, color = 'WHITE'):
+class HostGovernor():
+    '''
+    Limit the number of concurrent network operations (clones and fetches) per host, 
+    across threads and processes, and enable the connection reuse for the host.
+
+    The slots of each host are lock files in lock_dir, held with 'fcntl.flock', so 
+    several copy_ processes running at the same time share the limit. When all the 
+    slots of a host are taken, the operation waits in queue until one is released.
+    If the host answers with a rate-limit error, the operation is retried with 
+    exponential backoff.
+
+    Within one git process HTTP connections are kept alive by git itself. For SSH urls, 
+    get_env returns a GIT_SSH_COMMAND with ControlMaster, so all the git processes 
+    for the same host reuse one SSH connection.
+
+    Parameters:
+        max_per_host: int, default DEFAULT_MAX_PER_HOST.
+            The maximum number of concurrent operations per host.
+        lock_dir: str, default None.
+            The directory of the lock files and SSH control sockets. If None, 
+            'copy_-hosts' in the temporary directory.
+        retries: int, default 5.
+            The maximum number of retries after a rate-limit error.
+        backoff: float, default 2.
+            The seconds to wait before the first retry, doubled for each retry.
+        poll_interval: float, default 0.2.
+            The seconds to wait between tries to take a slot.
+
+    Attributes:
+        max_per_host, lock_dir, retries, backoff, poll_interval.
+            Store the parameters.
+        RATE_LIMIT_PATTERN: regex.
+            Class attribute. Match the rate-limit error messages.
+    '''
+    RATE_LIMIT_PATTERN = re.compile(r'\b429\b|too many requests|rate limit', re.IGNORECASE)
+
+    def __init__(self,
+                max_per_host=None,
+                lock_dir=None,
+                retries=5,
+                backoff=2,
+                poll_interval=0.2):
+
+        self.max_per_host = max_per_host or DEFAULT_MAX_PER_HOST
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'copy_-hosts')
+        self.retries = retries
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+
+    @contextmanager
+    def slot(self, url):
+        '''
+        Context manager that holds one of the slots of the host of url while running. 
+        Local urls (without host) are not limited.
+        '''
+        host = get_url_host(url)
+        if not host:
+            yield
+            return
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+        waiting = False
+        while True:
+            for index in range(self.max_per_host):
+                lock_file = open(os.path.join(self.lock_dir, '{0}.{1}.lock'.format(host, index)), 'w')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    continue
+
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+                return
+
+            if not waiting:
+                print_colored("All the {0} slots of {1} are in use. Waiting.".format(self.max_per_host, host))
+                waiting = True
+            time.sleep(self.poll_interval)
+
+    def run(self, url, operation, *args, **kwargs):
+        '''
+        Call operation with args and kwargs holding a slot of the host of url, and 
+        return its result. Retry with exponential backoff if the error is a rate limit.
+        '''
+        attempt = 0
+        while True:
+            with self.slot(url):
+                try:
+                    return operation(*args, **kwargs)
+                except Exception as error:
+                    if attempt >= self.retries or not self.RATE_LIMIT_PATTERN.search(str(error)):
+                        raise
+
+            delay = self.backoff * 2 ** attempt
+            print_colored("Rate limited by {0}. Retrying in {1} seconds.".format(get_url_host(url), delay),
+                        color='RED')
+            time.sleep(delay)
+            attempt += 1
+
+    def get_env(self, url):
+        '''
+        Return a dict with the environment variables for git to reuse the connections 
+        to the host of url. Only SSH urls need them.
+        '''
+        if not is_ssh_url(url):
+            return {}
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+        return {'GIT_SSH_COMMAND': 'ssh -o ControlMaster=auto -o ControlPersist=60 '
+                                '-o ControlPath={}'.format(os.path.join(self.lock_dir, 'ssh-%C'))}
+
+class GitWatchdog():
+    '''
+    Run git commands enforcing the deadlines of their phase ('clone', 'fetch', 'checkout' 
+    or 'merge'). The command is killed, with all its process tree (remote helpers, ssh), 
+    when it runs longer than the timeout of its phase, or when a command run with 
+    '--progress' (clone and fetch) does not write any output for stall_timeout seconds, 
+    and GitTimeout is raised. The commands without progress (checkout, merge) are silent 
+    while they work, so they are only limited by the timeout of their phase. The timed 
+    out commands can be retried, each retry starts a new git process, so a new 
+    connection, without reusing the SSH master connection.
+
+    Parameters:
+        timeouts: dict, default None.
+            The seconds allowed for each phase {phase: seconds}. The phases not 
+            included have not timeout.
+        stall_timeout: float, default None.
+            The seconds allowed without output to the commands run with '--progress'. 
+            If None, the stalls are not detected.
+        retries: int, default 0.
+            The number of retries of a timed out command.
+        poll_interval: float, default 0.1.
+            The seconds between the checks of the deadlines.
+
+    Attributes:
+        timeouts, stall_timeout, retries, poll_interval.
+            Store the parameters.
+        PHASES: list(str).
+            Class attribute. The phases with timeouts.
+    '''
+    PHASES = ['clone', 'fetch', 'checkout', 'merge']
+
+    def __init__(self,
+                timeouts=None,
+                stall_timeout=None,
+                retries=0,
+                poll_interval=0.1):
+
+        self.timeouts = dict(timeouts or {})
+        self.stall_timeout = stall_timeout
+        self.retries = retries
+        self.poll_interval = poll_interval
+
+    def run(self, phase, command, cwd=None, env=None, before_retry=None):
+        '''
+        Run command (a list) in cwd with the environment variables env added, and return 
+        its output. Retry it up to retries attribute times if it times out, calling 
+        before_retry (if not None) to clean up what the killed command left.
+
+        Raises:
+            GitTimeout:
+                If the last try timed out.
+            git.exc.GitCommandError:
+                If the command failed.
+        '''
+        attempt = 0
+        while True:
+            try:
+                return self.execute(phase, command, cwd=cwd, env=env, fresh_connection=attempt > 0)
+            except GitTimeout as error:
+                if attempt >= self.retries:
+                    raise
+                print_colored("{} Retrying with a new connection.".format(error), color='RED')
+                if before_retry:
+                    before_retry()
+                attempt += 1
+
+    def execute(self, phase, command, cwd=None, env=None, fresh_connection=False):
+        '''
+        Run command once under the deadlines of phase. See run method.
+        '''
+        process_env = dict(os.environ)
+        process_env.update(env or {})
+        if fresh_connection and 'GIT_SSH_COMMAND' in process_env:
+            process_env['GIT_SSH_COMMAND'] = 'ssh -o ControlMaster=no -o ControlPath=none'
+
+        # A new session, so the whole process tree can be killed
+        process = subprocess.Popen(command, cwd=cwd, env=process_env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, start_new_session=True)
+        outputs = {'stdout': [], 'stderr': []}
+        activity = [time.time()]
+        readers = [threading.Thread(target=self.read, args=(stream, outputs[name], activity))
+                    for name, stream in (('stdout', process.stdout), ('stderr', process.stderr))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        start = time.time()
+        timeout = self.timeouts.get(phase)
+        stall_timeout = self.stall_timeout if '--progress' in command else None
+        reason = None
+        while True:
+            try:
+                process.wait(timeout=self.poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+
+            now = time.time()
+            if timeout is not None and now - start > timeout:
+                reason = 'did not finish in {} seconds'.format(timeout)
+            elif stall_timeout is not None and now - activity[0] > stall_timeout:
+                reason = 'had no progress for {} seconds'.format(stall_timeout)
+
+            if reason:
+                self.kill(process)
+                process.wait()
+                break
+
+        for reader in readers:
+            reader.join()
+
+        stdout = b''.join(outputs['stdout']).decode('utf-8', 'replace')
+        stderr = b''.join(outputs['stderr']).decode('utf-8', 'replace')
+
+        if reason:
+            raise GitTimeout("The {0} '{1}' {2}.".format(phase, ' '.join(command), reason))
+
+        if process.returncode != 0:
+            raise GitCommandError(command, process.returncode, stderr, stdout)
+
+        return stdout[:-1] if stdout.endswith('\n') else stdout
+
+    def read(self, stream, chunks, activity):
+        '''
+        Read stream until EOF into chunks, updating the time of the last activity.
+        '''
+        for chunk in iter(lambda: os.read(stream.fileno(), 65536), b''):
+            chunks.append(chunk)
+            activity[0] = time.time()
+        stream.close()
+
+    def kill(self, process):
+        '''
+        Kill process and all the processes of its session.
+        '''
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+class EventLog():
     '''
-    Print in stdout the argument string colored by argument color.
-    The default color is WHITE.
+    Write the log messages and the phase events in stream.
+
+    In 'text' format the messages are written as lines, colored only if stream is a 
+    TTY. In 'json' format each phase (see phase method) is written as one JSON event 
+    with its repo, ref, sha and duration fields, and only the messages of level 
+    WARNING or higher are written, as 'message' events.
+    The writes are buffered and flushed together (so the lines of several jobs sharing 
+    stdout do not interleave) at the end of each phase, on errors, when the buffer is 
+    full and at exit. If stream is a TTY, each line is flushed at once.
+
+    Parameters:
+        stream: file, default None.
+            The stream where the log is written. If None, sys.stdout.
+        log_format: str, default 'text'.
+            The format of the log, one of FORMATS.
+        level: str, default 'INFO'.
+            The lowest level of the messages written, one of LEVELS.
+        color: bool, default None.
+            If is True color the text messages. If None, color only if stream is a TTY.
+        buffer_size: int, default 64.
+            The number of writes buffered before flush.
+
+    Attributes:
+        stream, log_format, level, color, buffer_size.
+            Store the parameters.
+        buffer: list(str).
+            Store the writes not flushed yet.
+        LEVELS: dict.
+            Class attribute. The value of each level name.
+        FORMATS: list(str).
+            Class attribute. The formats allowed.
+        COLORS: dict.
+            Class attribute. The ANSI codes of the colors.
     '''
+    LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+    FORMATS = ['text', 'json']
     COLORS = {
             'GREEN': "\033[1;32;40m",
             'RED': "\033[1;31;40m",
             'DEFAULT': "\033[0;37;40m"
     }
-    
-    if str(color).upper() in COLORS:
-        print(COLORS.get(color) + str(string) + COLORS.get('DEFAULT'))
-    else:
-        print(COLORS.get('DEFAULT') + str(string) + COLORS.get('DEFAULT'))
+
+    def __init__(self, stream=None, log_format='text', level='INFO', color=None, buffer_size=64):
+        self.stream = stream
+        self.log_format = log_format
+        self.level = level
+        self.color = color
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def configure(self, log_format=None, level=None, color=None):
+        '''
+        Change the log_format, level and color attributes that are not None.
+        '''
+        self.flush()
+        if log_format is not None:
+            self.log_format = log_format
+        if level is not None:
+            self.level = level
+        if color is not None:
+            self.color = color
+
+    def get_stream(self):
+        '''
+        Return the stream attribute, or the current sys.stdout if it is None.
+        '''
+        return self.stream or sys.stdout
+
+    def is_tty(self):
+        '''
+        Return True if the stream is a TTY, else False.
+        '''
+        isatty = getattr(self.get_stream(), 'isatty', None)
+        return bool(isatty and isatty())
+
+    def write(self, message, level='INFO', color=None):
+        '''
+        Write message if level is not lower than level attribute. See the class formats.
+        '''
+        if EventLog.LEVELS[level] < EventLog.LEVELS[self.level]:
+            return
+
+        if self.log_format == 'json':
+            if EventLog.LEVELS[level] >= EventLog.LEVELS['WARNING']:
+                self.emit({'event': 'message', 'level': level, 'message': str(message)})
+            return
+
+        colored = self.is_tty() if self.color is None else self.color
+        if colored:
+            code = EventLog.COLORS.get(str(color).upper(), EventLog.COLORS['DEFAULT'])
+            message = code + str(message) + EventLog.COLORS['DEFAULT']
+        self.append(str(message) + '\n', flush=EventLog.LEVELS[level] >= EventLog.LEVELS['ERROR'])
+
+    def emit(self, event):
+        '''
+        Write event, a dict, as one JSON line with its time, in 'json' format.
+        '''
+        if self.log_format != 'json':
+            return
+
+        event = dict(event, time=round(time.time(), 3))
+        self.append(json.dumps(event, sort_keys=True) + '\n', flush=event.get('level') == 'ERROR')
+
+    def append(self, text, flush=False):
+        '''
+        Add text to the buffer, and flush it if flush is True, the buffer is full or 
+        stream is a TTY.
+        '''
+        with self.lock:
+            self.buffer.append(text)
+            full = len(self.buffer) >= self.buffer_size
+        if flush or full or self.is_tty():
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the buffer in the stream in one write.
+        '''
+        with self.lock:
+            text, self.buffer = ''.join(self.buffer), []
+        if text:
+            stream = self.get_stream()
+            stream.write(text)
+            stream.flush()
+
+    @contextmanager
+    def phase(self, name, **fields):
+        '''
+        Context manager that measures the phase name and emits its event when it ends, 
+        with the fields and the 'duration' in seconds, and 'status' 'ok' or 'error'. 
+        It yields the event dict, to add fields (like 'sha') known during the phase.
+        In 'text' format the duration is written at DEBUG level.
+        '''
+        event = dict(fields, event='phase', phase=name, status='ok')
+        start = time.time()
+        try:
+            yield event
+        except BaseException as error:
+            event['status'] = 'error'
+            event['error'] = str(error)
+            event['level'] = 'ERROR'
+            raise
+        finally:
+            event['duration'] = round(time.time() - start, 3)
+            self.emit(event)
+            self.write("Phase {0} {1} in {2:.2f} seconds.".format(name, event['status'], event['duration']),
+                    level='DEBUG')
+            self.flush()
+
+LOG = EventLog()
+atexit.register(LOG.flush)
+
+class TrashCollector():
+    '''
+    Delete directories in background. The directory is renamed at once into a trash 
+    directory in the same filesystem, so the path is free when discard returns, and 
+    then deleted by a background thread with parallel unlink workers.
+    The module instance TRASH waits for the pending deletions at exit.
+
+    Parameters:
+        workers: int, default DEFAULT_DELETE_WORKERS.
+            The number of parallel unlink workers of each deletion.
+
+    Attributes:
+        workers: int.
+            Store the number of parallel unlink workers.
+        threads: list(threading.Thread).
+            Store the threads of the pending deletions.
+        TRASH_NAME: str.
+            Class attribute. The name of the trash directory.
+    '''
+    TRASH_NAME = '.copy_-trash'
+
+    def __init__(self, workers=None):
+        self.workers = workers or DEFAULT_DELETE_WORKERS
+        self.threads = []
+
+    def discard(self, path, trash_root=None):
+        '''
+        Move the directory path into the trash directory in trash_root and delete it 
+        in background. If it can not be moved (for example, the trash directory is in 
+        other filesystem or can not be created), delete it before return.
+
+        Parameters:
+            path: str.
+                The directory to delete.
+            trash_root: str, default None.
+                The directory where the trash directory is created. If None, the parent 
+                directory of path. It must not be inside path.
+
+        Return:
+            None.
+        '''
+        path = os.path.abspath(path)
+        trash_dir = os.path.join(trash_root or os.path.dirname(path), TrashCollector.TRASH_NAME)
+        trashed = None
+        # A pending deletion removes the trash directory when it gets empty, so create it again
+        while trashed is None:
+            try:
+                os.makedirs(trash_dir, exist_ok=True)
+            except OSError:
+                shutil.rmtree(path)
+                return
+            try:
+                trashed = tempfile.mkdtemp(dir=trash_dir)
+            except FileNotFoundError:
+                pass
+
+        try:
+            os.rename(path, os.path.join(trashed, os.path.basename(path)))
+        except OSError:
+            os.rmdir(trashed)
+            shutil.rmtree(path)
+            return
+
+        thread = threading.Thread(target=self.delete, args=(trashed,))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def delete(self, path):
+        '''
+        Delete the directory path, unlinking its files with parallel workers, and then 
+        the trash directory that contains it if it is empty.
+        '''
+        files, directories = [], []
+        for root, dirnames, filenames in os.walk(path, topdown=False):
+            files.extend(os.path.join(root, name) for name in filenames)
+            # The links to directories are not walked, they are unlinked like files
+            files.extend(os.path.join(root, name) for name in dirnames
+                        if os.path.islink(os.path.join(root, name)))
+            directories.append(root)
+
+        # Plain threads, the executors do not take new work once the interpreter is exiting
+        pending = iter(files)
+        lock = threading.Lock()
+
+        def unlink():
+            while True:
+                with lock:
+                    file_path = next(pending, None)
+                if file_path is None:
+                    return
+                os.unlink(file_path)
+
+        workers = [threading.Thread(target=unlink) for _ in range(min(self.workers, len(files)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        for directory in directories:
+            os.rmdir(directory)
+
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    def wait(self):
+        '''
+        Wait until all the pending deletions are done.
+        '''
+        if any(thread.is_alive() for thread in self.threads):
+            print_colored("Waiting for the pending deletions.")
+
+        while self.threads:
+            self.threads.pop().join()
+
+TRASH = TrashCollector()
+atexit.register(TRASH.wait)
+
+# Define Functions
+def get_url_host(url):
+    '''
+    Return the host name of the repository url, or None for local paths.
+
+    Example:
+        url = https://github.com/openworm/org.geppetto.git
+        return => github.com
+        url = git@github.com:openworm/org.geppetto.git
+        return => github.com
+    '''
+    if re.match(r'^[a-z][a-z0-9+.-]*://', url, re.IGNORECASE):
+        match = re.match(r'^[a-z][a-z0-9+.-]*://(?:[^@/]*@)?([^/:]+)', url, re.IGNORECASE)
+        if not match or url.lower().startswith('file:'):
+            return None
+        return match.group(1).lower()
+
+    # scp-like syntax 'user@host:path'
+    match = re.match(r'^(?:[^@/]*@)?([^/:]+):', url)
+    if match and not os.path.exists(url):
+        return match.group(1).lower()
+
+    return None
+
+def is_build_repository(url):
+    '''
+    Return True if the repository url is the one that triggered the build, set as 
+    'owner/name' in the environment variable TRAVIS_REPO_SLUG, else False.
+
+    Example:
+        TRAVIS_REPO_SLUG = openworm/org.geppetto
+        url = https://github.com/openworm/org.geppetto.git
+        return => True
+    '''
+    slug = os.getenv(TRAVIS_REPO_SLUG)
+    if not slug:
+        return False
+
+    path = url.rstrip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    return [part.lower() for part in re.split(r'[/:]', path)[-2:]] == slug.lower().split('/')
+
+def is_ssh_url(url):
+    '''
+    Return True if url is a SSH repository url, else False.
+    '''
+    if re.match(r'^(ssh|git\+ssh|ssh\+git)://', url, re.IGNORECASE):
+        return True
+    return not re.match(r'^[a-z][a-z0-9+.-]*://', url, re.IGNORECASE) and get_url_host(url) is not None
+
+def print_colored(string, color = 'WHITE'):
+    '''
+    Write in the event log LOG the argument string colored by argument color.
+    The default color is WHITE. The RED strings are logged as errors.
+    See EventLog class.
+    '''
+    LOG.write(string, level='ERROR' if str(color).upper() == 'RED' else 'INFO', color=color)
+
+def get_config_env(config):
+    '''
+    Return a dict with the environment variables GIT_CONFIG_COUNT, GIT_CONFIG_KEY_<n> and 
+    GIT_CONFIG_VALUE_<n> that set the git configuration config, a dict {key: value}, 
+    after the configuration already set in the environment.
+    '''
+    count = int(os.environ.get('GIT_CONFIG_COUNT') or 0)
+    env = {}
+    for key, value in sorted(config.items()):
+        env['GIT_CONFIG_KEY_{}'.format(count)] = key
+        env['GIT_CONFIG_VALUE_{}'.format(count)] = str(value)
+        count += 1
+    env['GIT_CONFIG_COUNT'] = str(count)
+    return env
 
 def get_env_var(var_name, default = None):
     '''
@@ -530,27 +1899,567 @@ def get_env_var(var_name, default = None):
         print_colored("env var {0} not found. Set default value: {1}".format(var_name, default))
     return env_var
 
-def get_parse_args(args=None):
+def read_lock_file(lock_path, url):
+    '''
+    Return the entry of url in the lock file lock_path (see write_lock_file).
+
+    Raises:
+        LockFileError:
+            If url is not recorded in the lock file.
+    '''
+    with open(lock_path) as lock_file:
+        repos = json.load(lock_file).get('repos', {})
+
+    if url not in repos:
+        raise LockFileError('The repository {0} is not recorded in {1}.'.format(url, lock_path))
+
+    return repos[url]
+
+def write_lock_file(lock_path, url, entry):
+    '''
+    Record entry for url in the lock file lock_path, a JSON file with the format 
+    {"repos": {url: entry}}. The entries of other repositories already recorded 
+    in the file are kept, so the same lock file can be shared by several runs. The 
+    runs writing at the same time are serialized with an exclusive lock on a guard 
+    file of the temporary directory, named by the absolute lock_path, so no entry is 
+    lost and nothing else is left next to the lock file.
+    '''
+    guard_path = os.path.join(tempfile.gettempdir(), 'copy_-{}.guard'.format(
+                            hashlib.sha1(os.path.abspath(lock_path).encode('utf-8')).hexdigest()))
+    with open(guard_path, 'w') as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX)
+
+        lock = {'repos': {}}
+        if os.path.exists(lock_path):
+            with open(lock_path) as lock_file:
+                lock = json.load(lock_file)
+
+        lock.setdefault('repos', {})[url] = entry
+        write_json(lock_path, lock)
+
+    print_colored("Commits recorded in {}.".format(lock_path))
+
+def write_json(json_path, data):
+    '''
+    Write data as JSON in json_path, replacing the file atomically. Each writer uses 
+    its own temporary file, so concurrent writers do not clobber each other.
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(json_path)),
+                                    prefix=os.path.basename(json_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as json_file:
+            json.dump(data, json_file, indent=2, sort_keys=True)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, json_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def copy_file(strategy, source, dest):
+    '''
+    Copy the file source to dest with strategy: 'reflink' (a copy-on-write clone that 
+    shares the data blocks, only supported by some filesystems like btrfs or xfs), 
+    'hardlink' (the same file, so dest must be read-only for its consumers) or 'copy'.
+    The mode bits are kept.
+    '''
+    if strategy == 'hardlink':
+        os.link(source, dest)
+    elif strategy == 'reflink':
+        with open(source, 'rb') as source_file, open(dest, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+        shutil.copymode(source, dest)
+    else:
+        shutil.copy2(source, dest)
+
+def copy_tree(source, dest, mode='auto', workers=None):
+    '''
+    Copy the directory source to dest, copying the files with workers parallel threads 
+    and recreating the symbolic links. The mode is one of COPY_MODES:
+        -auto: reflink the files, or copy them if the filesystem does not support it.
+        -hardlink: hardlink the files, or copy them if dest is in other filesystem.
+        -copy: copy the files.
+    The strategy is probed with the first file, and used for all the files.
+
+    Parameters:
+        source: str.
+            The directory to copy.
+        dest: str.
+            The new directory, it must not exist.
+        mode: str, default 'auto'.
+            One of COPY_MODES.
+        workers: int, default DEFAULT_COPY_WORKERS.
+            The number of parallel copy threads.
+
+    Return:
+        dict with keys:
+            strategy: str. The strategy used, 'reflink', 'hardlink' or 'copy'.
+            files: int. The number of files copied.
+    '''
+    files = []
+    for root, dirnames, filenames in os.walk(source):
+        dest_root = os.path.normpath(os.path.join(dest, os.path.relpath(root, source)))
+        os.makedirs(dest_root)
+        for name in dirnames + filenames:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(dest_root, name))
+            elif name in filenames:
+                files.append((path, os.path.join(dest_root, name)))
+
+    total = len(files)
+    strategy = 'reflink' if mode == 'auto' else mode
+    if files and strategy != 'copy':
+        try:
+            copy_file(strategy, *files[0])
+        except OSError as error:
+            if error.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM):
+                raise
+            strategy = 'copy'
+            copy_file(strategy, *files[0])
+        files = files[1:]
+
+    with ThreadPoolExecutor(max_workers=workers or DEFAULT_COPY_WORKERS) as executor:
+        # Consume the results, so the errors are raised
+        list(executor.map(lambda paths: copy_file(strategy, *paths), files))
+
+    return {'strategy': strategy, 'files': total}
+
+def maintain_repository(path, budget=None, time_fetch=True, batch_size='0'):
+    '''
+    Run the maintenance tasks on the repository in path, to keep fast the fetch 
+    negotiation and the merge base computation of long-lived clones:
+        -commit-graph: write the commit-graph of the reachable commits.
+        -loose-objects: pack the loose objects into a new pack.
+        -multi-pack-index: consolidate the packs in batches of batch_size ('0' repacks 
+         all the packs into one) and expire the packs already included.
+        -bitmaps: write the reachability bitmaps of the multi-pack-index.
+        -prune: delete the unreachable loose objects older than 2 weeks.
+    When the seconds of budget are spent, the remaining tasks are skipped.
+    The time of 'git fetch' (if time_fetch is True) and of 'git merge-base' (see 
+    time_repository) are logged before and after the tasks.
+
+    Parameters:
+        path: str.
+            The directory of the repository.
+        budget: float, default None.
+            The seconds available for the tasks. If None, there is no limit.
+        time_fetch: bool, default True.
+            If is True time 'git fetch origin' before and after the tasks.
+        batch_size: str, default '0'.
+            The '--batch-size' of 'git multi-pack-index repack'.
+
+    Return:
+        dict with the seconds spent by each task, and the 'before' and 'after' 
+        timings of 'fetch' and 'merge-base'.
+    '''
+    repo = Repo(path)
+    tasks = [
+        ('commit-graph', [['commit-graph', 'write', '--reachable', '--changed-paths']]),
+        ('loose-objects', [['repack', '-d', '-l']]),
+        ('multi-pack-index', [['multi-pack-index', 'write'],
+                            ['multi-pack-index', 'repack', '--batch-size={}'.format(batch_size)],
+                            ['multi-pack-index', 'expire']]),
+        ('bitmaps', [['multi-pack-index', 'write', '--bitmap']]),
+        ('prune', [['prune', '--expire', '2.weeks.ago']]),
+    ]
+
+    print_colored("Maintaining the repository {}.".format(path))
+    timings = {'before': time_repository(repo, time_fetch), 'tasks': {}}
+    start = time.time()
+
+    for name, commands in tasks:
+        if budget is not None and time.time() - start >= budget:
+            print_colored("The budget of {0} seconds is spent. Skip {1}.".format(budget, name), color='RED')
+            continue
+
+        task_start = time.time()
+        try:
+            for command in commands:
+                repo.git.execute(['git'] + command)
+        except Exception as error:
+            print_colored("The task {0} failed: {1}".format(name, error), color='RED')
+            continue
+
+        timings['tasks'][name] = time.time() - task_start
+        print_colored("Task {0} done in {1:.2f} seconds.".format(name, timings['tasks'][name]))
+
+    timings['after'] = time_repository(repo, time_fetch)
+    for operation in sorted(timings['after']):
+        print_colored("{0}: {1:.3f} seconds before, {2:.3f} seconds after.".format(operation,
+                    timings['before'][operation], timings['after'][operation]), color='GREEN')
+
+    return timings
+
+def time_repository(repo, time_fetch=True):
+    '''
+    Return a dict with the seconds spent by 'git fetch origin' (if time_fetch is True) 
+    and by 'git merge-base' between HEAD and the ref of get_merge_base_ref in repo. 
+    The fetch is run once untimed before, so the timed fetch has not objects to download 
+    and measures only the negotiation and the connectivity check, the part changed by 
+    the maintenance tasks. Otherwise the 'before' fetch would download the pending 
+    objects and the 'after' fetch would have nothing to do.
+    The operations that fail are logged and not included.
+    '''
+    operations = {}
+    ref = get_merge_base_ref(repo)
+    if ref:
+        operations['merge-base'] = ['merge-base', 'HEAD', ref]
+    else:
+        print_colored("There is not a branch to time 'git merge-base' with HEAD.")
+
+    if time_fetch:
+        operations['fetch'] = ['fetch', 'origin']
+        try:
+            repo.git.execute(['git', 'fetch', 'origin'])
+        except Exception:
+            pass
+
+    timings = {}
+    for name, command in operations.items():
+        start = time.time()
+        try:
+            repo.git.execute(['git'] + command)
+        except Exception as error:
+            print_colored("The timing of {0} failed: {1}".format(name, error), color='RED')
+            continue
+        timings[name] = time.time() - start
+
+    return timings
+
+def get_merge_base_ref(repo):
+    '''
+    Return the ref of repo to time 'git merge-base' with HEAD: 'origin/HEAD' in the 
+    clones, or in the bare repositories (the bundle cache and the prefetch store keep 
+    the branches in 'refs/heads') the branch with the newest commit other than HEAD. 
+    Return None if there is not any.
+    '''
+    try:
+        repo.git.rev_parse('--verify', '--quiet', 'origin/HEAD')
+        return 'origin/HEAD'
+    except Exception:
+        pass
+
+    try:
+        head = repo.git.symbolic_ref('--quiet', 'HEAD')
+    except Exception:
+        head = None
+
+    refs = repo.git.for_each_ref('--sort=-committerdate', '--format=%(refname)', 'refs/heads').splitlines()
+    return next((ref for ref in refs if ref != head), None)
+
+def create_bundle(url, bundle_dir, governor=None, maintain=False, maintenance_budget=None):
+    '''
+    Create or refresh the bundle of the repository url in bundle_dir, to seed the clones 
+    (see TravisRepoAction seed_bundle parameter). A bare clone '<path>.git' of the 
+    branches and tags of url is kept in bundle_dir, so refreshing only fetches the new 
+    commits, and the bundle '<path>.bundle' is rewritten from it atomically.
+
+    Parameters:
+        url: str.
+            The url repository.
+        bundle_dir: str.
+            The directory of the bundles.
+        governor: class HostGovernor, default None.
+            The limiter of the network operations per host.
+        maintain: bool, default False.
+            If is True run maintain_repository on the bare clone after the fetch.
+        maintenance_budget: float, default None.
+            The seconds available for the maintenance tasks. If None, there is no limit.
+
+    Return:
+        bundle: str.
+            The bundle file.
+    '''
+    governor = governor or HostGovernor()
+    name = TravisRepoAction(url).path
+    cache = os.path.join(bundle_dir, name + '.git')
+    bundle = os.path.abspath(os.path.join(bundle_dir, name + '.bundle'))
+
+    if os.path.isdir(cache):
+        print_colored("Refreshing {}.".format(cache))
+        repo = Repo(cache)
+    else:
+        print_colored("Cloning {0} into {1}.".format(url, cache))
+        repo = Repo.init(cache, bare=True)
+        repo.create_remote('origin', url)
+        repo.git.config('remote.origin.fetch', '+refs/heads/*:refs/heads/*')
+
+    repo.git.update_environment(**governor.get_env(url))
+    governor.run(url, repo.git.fetch, '--prune', '--tags', 'origin')
+    # Point HEAD to the default branch of the remote, so it is the branch checked out by the seeded clones
+    head = governor.run(url, repo.git.ls_remote, '--symref', 'origin', 'HEAD')
+    if head.startswith('ref: '):
+        repo.git.symbolic_ref('HEAD', head.split()[1])
+
+    if maintain:
+        maintain_repository(cache, budget=maintenance_budget, time_fetch=False)
+
+    # Each refresh writes its own temporary bundle, so concurrent refreshes do not clobber each other
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(bundle), prefix=os.path.basename(bundle) + '.',
+                                    suffix='.tmp')
+    os.close(fd)
+    try:
+        repo.git.bundle('create', tmp_path, '--all')
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, bundle)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    print_colored("The bundle {} was created successfully.".format(bundle), color='GREEN')
+
+    return bundle
+
+def get_prefetch_paths(url, store):
     '''
-    Implement the command-line arguments. The options are:
+    Return the tuple (repository, marker file, lock file) of the prefetch of url in 
+    the directory store.
+    '''
+    name = os.path.join(os.path.abspath(store), TravisRepoAction(url).path)
+    return name + '.git', name + '.prefetch.json', name + '.prefetch.lock'
+
+def prefetch_repository(url, store, branches, default_branch=None, governor=None, maintain=False,
+                        maintenance_budget=None):
+    '''
+    Fetch the branches (or tags) of url that exist into a bare repository in store, 
+    so a later clone with the same branches (see TravisRepoAction prefetch_store 
+    parameter) needs no network. The refs of the repository are exactly the 
+    existing branches, so the later branches resolution is the same as from url.
+    While fetching, an exclusive lock is held on the lock file, so the clones wait for 
+    it, and the marker file records the state 'running', and then 'complete' with 
+    the branches requested and the refs fetched (or 'failed').
+
+    Parameters:
+        url: str.
+            The url repository.
+        store: str.
+            The directory of the prefetched repositories.
+        branches: list(str).
+            The branches or tags names needed.
+        default_branch: str, default None.
+            The branch checked out by the clones.
+        governor: class HostGovernor, default None.
+            The limiter of the network operations per host.
+        maintain: bool, default False.
+            If is True run maintain_repository on the repository after the fetch.
+        maintenance_budget: float, default None.
+            The seconds available for the maintenance tasks. If None, there is no limit.
+
+    Return:
+        refs: dict.
+            The commit fetched for each ref.
+    '''
+    governor = governor or HostGovernor()
+    repo_dir, marker_path, lock_path = get_prefetch_paths(url, store)
+    branches = sorted(set(branch for branch in branches if branch))
+    os.makedirs(store, exist_ok=True)
+
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        write_json(marker_path, {'state': 'running', 'url': url, 'pid': os.getpid()})
+
+        try:
+            if os.path.isdir(repo_dir):
+                repo = Repo(repo_dir)
+            else:
+                repo = Repo.init(repo_dir, bare=True)
+                repo.create_remote('origin', url)
+            repo.git.update_environment(**governor.get_env(url))
+
+            print_colored("Prefetching {0} of {1}.".format(', '.join(branches), url))
+            remote_refs = governor.run(url, repo.git.ls_remote, '--heads', '--tags', 'origin')
+            available = set(line.split('\t')[1] for line in remote_refs.splitlines())
+            wanted = [prefix + branch for branch in branches for prefix in ('refs/heads/', 'refs/tags/')
+                        if prefix + branch in available]
+
+            if wanted:
+                governor.run(url, repo.git.fetch, '--no-tags', 'origin', *['+{0}:{0}'.format(ref) for ref in wanted])
+
+            # Drop the refs of previous prefetches, the clones must see only the existing ones
+            for ref in repo.git.for_each_ref('--format=%(refname)').splitlines():
+                if ref not in wanted:
+                    repo.git.update_ref('-d', ref)
+
+            if default_branch and 'refs/heads/' + default_branch in wanted:
+                repo.git.symbolic_ref('HEAD', 'refs/heads/' + default_branch)
+
+            refs = dict((ref, repo.git.rev_parse(ref)) for ref in wanted)
+
+            if maintain:
+                maintain_repository(repo_dir, budget=maintenance_budget, time_fetch=False)
+
+        except Exception:
+            write_json(marker_path, {'state': 'failed', 'url': url})
+            raise
+
+        write_json(marker_path, {'state': 'complete', 'url': url, 'branches': branches,
+                                'refs': refs, 'time': time.time()})
+
+    print_colored("The prefetch of {} is complete.".format(url), color='GREEN')
+    return refs
+
+def prefetch(args=None):
+    '''
+    Run the 'prefetch' command with the command-line arguments args, the same arguments 
+    of the later 'copy_.py' invocation plus --background. The branches are resolved 
+    like validate_args does.
+    With --background, run the prefetch in a detached process (logging to 
+    '<repository>.prefetch.log' in the store) and return once it holds the lock.
+    '''
+    args = list(args or [])
+    data = validate_args(args, prefetch=True)
+    repo_dir, marker_path, lock_path = get_prefetch_paths(data.url, data.prefetch_store)
+
+    if not data.background:
+        origins = data.origin if isinstance(data.origin, list) else [data.origin]
+        prefetch_repository(data.url, data.prefetch_store, [data.target, data.default] + origins,
+                            default_branch=data.default, governor=HostGovernor(max_per_host=data.max_per_host),
+                            maintain=data.maintain, maintenance_budget=data.maintenance_budget)
+        return
+
+    os.makedirs(data.prefetch_store, exist_ok=True)
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+    args.remove('--background')
+    with open(repo_dir[:-len('.git')] + '.prefetch.log', 'w') as log_file:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'prefetch'] + args,
+                                    stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+
+    # Return once the background process holds the lock, so the clones wait for it
+    while process.poll() is None and not os.path.exists(marker_path):
+        time.sleep(0.05)
+    print_colored("Prefetching {0} in background (pid {1}).".format(data.url, process.pid))
+
+def get_bundle_parse_args(args=None):
+    '''
+    Implement the command-line arguments of 'bundle' command. The options are:
+     bundle_dir (positional): Directory of the bundles.
+     urls (positional): URLs of the repositories.
+     [--max-per-host] (optional): Maximum concurrent fetches per host.
+     [--maintain] (optional): Run the maintenance tasks on the bare clones.
+     [--maintenance-budget] (optional): Seconds available for the maintenance tasks.
+
+    Run 'python copy_.py bundle --help' for more information.
+    '''
+    parse = argparse.ArgumentParser(prog='copy_.py bundle',
+                                    description='Create or refresh the git bundles of the repositories, '
+                                    'to seed the clones with --seed-bundle.')
+    parse.add_argument('bundle_dir', help='Directory of the bundles.')
+    parse.add_argument('urls', nargs='+', metavar='url', help='Repository URL.')
+    parse.add_argument('--max-per-host', dest='max_per_host', type=int, default=DEFAULT_MAX_PER_HOST,
+                        help='Maximum number of concurrent fetches per host.'
+                        ' Default value is {}.'.format(DEFAULT_MAX_PER_HOST))
+    parse.add_argument('--maintain', action='store_true',
+                        help='Run the maintenance tasks (see "copy_.py maintain --help") on the bare '
+                        'clones kept in bundle_dir after the fetch.')
+    parse.add_argument('--maintenance-budget', dest='maintenance_budget', type=float, default=None,
+                        help='Seconds available for the maintenance tasks of each clone.')
+
+    return parse.parse_args(args)
+
+def bundle(args=None):
+    '''
+    Run the 'bundle' command with the command-line arguments args.
+    '''
+    data = get_bundle_parse_args(args)
+    governor = HostGovernor(max_per_host=data.max_per_host)
+    os.makedirs(data.bundle_dir, exist_ok=True)
+
+    for url in data.urls:
+        create_bundle(url, data.bundle_dir, governor, maintain=data.maintain,
+                    maintenance_budget=data.maintenance_budget)
+
+def get_maintain_parse_args(args=None):
+    '''
+    Implement the command-line arguments of 'maintain' command. The options are:
+     path (positional): Directory of the repository.
+     [--budget] (optional): Seconds available for the maintenance tasks.
+     [--no-fetch-timing] (optional): Do not time 'git fetch'.
+
+    Run 'python copy_.py maintain --help' for more information.
+    '''
+    parse = argparse.ArgumentParser(prog='copy_.py maintain',
+                                    description='Write the commit-graph, consolidate the packs with '
+                                    'a multi-pack-index, write reachability bitmaps and prune a '
+                                    'long-lived clone, logging the fetch and merge-base timings '
+                                    'before and after.')
+    parse.add_argument('path', help='Directory of the repository.')
+    parse.add_argument('--budget', type=float, default=None,
+                        help='Seconds available for the tasks, the remaining tasks are skipped.')
+    parse.add_argument('--no-fetch-timing', dest='time_fetch', action='store_false',
+                        help='Do not time "git fetch" before and after the tasks.')
+
+    return parse.parse_args(args)
+
+def maintain(args=None):
+    '''
+    Run the 'maintain' command with the command-line arguments args.
+    '''
+    data = get_maintain_parse_args(args)
+    maintain_repository(data.path, budget=data.budget, time_fetch=data.time_fetch)
+
+def parse_timeout(value):
+    '''
+    Return the tuple (phase, seconds) of value 'PHASE=SECONDS', the type of --timeout.
+    '''
+    phase, _, seconds = value.partition('=')
+    if phase not in GitWatchdog.PHASES:
+        raise argparse.ArgumentTypeError('PHASE must be {}.'.format(' or '.join(GitWatchdog.PHASES)))
+    try:
+        return phase, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError('SECONDS must be a number.')
+
+def get_parse_args(args=None, prefetch=False):
+    '''
+    Implement the command-line arguments, of the 'prefetch' command if prefetch is True.
+    The options are:
      url (postional): URL of repository.
      [-t, --target-branch] (optional): Target branch name.
-     [-o, --origin-branch] (optional): Origin branch name.
+     [-o, --origin-branch] (optional): Origin branch name, can be repeated.
      [-d, --default-branch] (optional): Default branch name.
      [--pr, --push] (optional, mutually_exclusive_group): A bool value.
+     [--octopus] (optional): Merge the origin branches in a single octopus merge.
+     [--submodules] (optional): Initialize the submodules.
+     [--submodule-jobs] (optional): Number of submodules fetched concurrently.
+     [--full-submodules] (optional): Fetch the submodules with full history.
+     [--lock-out] (optional): Lock file to record the resolved commits.
+     [--lock-in] (optional): Lock file to replay the recorded commits.
+     [--changes-out] (optional): JSON file to write the changed paths.
+     [--changes-base] (optional): Base commit of the changed paths.
+     [--manifest-out] (optional): JSON file to write the blob and tree SHAs.
+     [--max-per-host] (optional): Maximum concurrent clones and fetches per host.
+     [--parallel-checkout] (optional): Number of parallel checkout workers.
+     [--seed-bundle] (optional): Bundle file or directory to seed the clone.
+     [--bundle-max-age] (optional): Maximum age in days of the seed bundle.
+     [--timeout] (optional): Timeout of a phase as PHASE=SECONDS, can be repeated.
+     [--stall-timeout] (optional): Seconds allowed without progress.
+     [--timeout-retries] (optional): Retries of the timed out git commands.
+     [--log-format] (optional): Format of the log, 'text' or 'json'.
+     [--log-level] (optional): Lowest level of the messages logged.
+     [--prefetch-store] (optional, required for prefetch): Directory of the prefetches.
+     [--background] (optional, only for prefetch): Prefetch in a detached process.
+     [--maintain] (optional, only for prefetch): Run the maintenance tasks on the store.
+     [--maintenance-budget] (optional, only for prefetch): Seconds for the maintenance tasks.
+     [--dest] (optional): Directory of the prepared tree, can be repeated.
+     [--dest-mode] (optional): Strategy of the copies to the extra destinations.
         
     Run 'python copy_.py --help' for more information.
 
     Parameters:
         args : list, default None
             The arguments parse in command-line, or passed as list.
+        prefetch : bool, default False
+            If is True parse the arguments of the 'prefetch' command.
         
     Return:
         parse_args: namespace
             A namespaces with arguments parse.
     '''
 
-    parse = argparse.ArgumentParser(description='Clones a GitHub repository and proceeds to checkout and '
+    parse = argparse.ArgumentParser(prog='copy_.py prefetch' if prefetch else None,
+                                    description='Clones a GitHub repository and proceeds to checkout and '
                                     'merge branches according to Travis-CI PR or PUSH test. '
                                     ''
                                     'If TARGET or ORIGIN are not provided, '
@@ -578,17 +2487,92 @@ def get_parse_args(args=None):
     parse.add_argument('-d', '--default-branch', dest='default', nargs='?', const=None, 
                         help='Default branch when target branch does not exist.'
                         ' Default value is the enviroment variable TRAVIS_DEFAULT_BRANCH or "master".')
-    parse.add_argument('-o', '--origin-branch', dest='origin', nargs='?', const=None, 
-                        help='Origin branch from PR. Default value is the enviroment variable'
-                        ' TRAVIS_PULL_REQUEST_BRANCH.')
+    parse.add_argument('-o', '--origin-branch', dest='origin', action='append', nargs='?', 
+                        help='Origin branch from PR. Can be repeated, the origin branches are merged in order.'
+                        ' Default value is the enviroment variable TRAVIS_PULL_REQUEST_BRANCH.')
+    parse.add_argument('--octopus', action='store_true',
+                        help='Merge all the origin branches in a single octopus merge.')
     group_travis_action_type = parse.add_mutually_exclusive_group()
     group_travis_action_type.add_argument('--pr', action='store_true', help='Set TRAVIS TEST as PULL REQUEST.')
     group_travis_action_type.add_argument('--push', action='store_true', help='Set TRAVIS TEST as PUSH.')
-
-    # Return the variables
-    return parse.parse_args(args)
-
-def validate_args(args=None):
+    parse.add_argument('--submodules', action='store_true',
+                        help='Initialize the submodules once the final commit is checked out.')
+    parse.add_argument('--submodule-jobs', dest='submodule_jobs', type=int, default=DEFAULT_SUBMODULE_JOBS,
+                        help='Number of submodules fetched concurrently.'
+                        ' Default value is {}.'.format(DEFAULT_SUBMODULE_JOBS))
+    parse.add_argument('--full-submodules', dest='shallow_submodules', action='store_false',
+                        help='Fetch the submodules with full history instead of depth 1.')
+    parse.add_argument('--lock-out', dest='lock_out', metavar='FILE',
+                        help='Record the resolved target, origin, merge and tag commits in FILE.')
+    parse.add_argument('--lock-in', dest='lock_in', metavar='FILE',
+                        help='Replay the commits recorded in FILE with depth 1, '
+                        'skipping the branches resolution.')
+    parse.add_argument('--changes-out', dest='changes_out', metavar='FILE',
+                        help='Write in FILE the paths changed from the target (or default) branch '
+                        'for PR, or from the previous commit for PUSH, as JSON.')
+    parse.add_argument('--changes-base', dest='changes_base', metavar='COMMIT',
+                        help='Base commit of the paths written by --changes-out. Default value for PUSH '
+                        'of the repository that triggered the build (TRAVIS_REPO_SLUG) is the first '
+                        'commit of the enviroment variable TRAVIS_COMMIT_RANGE, else the previous commit.')
+    parse.add_argument('--manifest-out', dest='manifest_out', metavar='FILE',
+                        help='Write in FILE the blob SHA of each file and the tree SHA of each '
+                        'directory of the final commit, as JSON.')
+    parse.add_argument('--max-per-host', dest='max_per_host', type=int, default=DEFAULT_MAX_PER_HOST,
+                        help='Maximum number of concurrent clones and fetches per host, shared by '
+                        'all the running copy_.py processes. Default value is {}.'.format(DEFAULT_MAX_PER_HOST))
+    parse.add_argument('--parallel-checkout', dest='checkout_workers', metavar='WORKERS', type=int,
+                        nargs='?', const=0, default=None,
+                        help='Write the files on checkout and merge with parallel workers. '
+                        'Without WORKERS, or 0, use one worker per available core.')
+    parse.add_argument('--seed-bundle', dest='seed_bundle', metavar='PATH',
+                        help='Git bundle file, or directory of bundles (see "copy_.py bundle --help"), '
+                        'to seed the clone. Only the commits newer than the bundle are fetched.')
+    parse.add_argument('--bundle-max-age', dest='bundle_max_age', metavar='DAYS', type=float,
+                        default=DEFAULT_BUNDLE_MAX_AGE,
+                        help='Do not seed from bundles older than DAYS.'
+                        ' Default value is {}.'.format(DEFAULT_BUNDLE_MAX_AGE))
+    parse.add_argument('--timeout', dest='timeouts', metavar='PHASE=SECONDS', type=parse_timeout,
+                        action='append', default=[],
+                        help='Kill the git commands of PHASE ({}) that run longer than SECONDS. '
+                        'Can be repeated.'.format(', '.join(GitWatchdog.PHASES)))
+    parse.add_argument('--stall-timeout', dest='stall_timeout', metavar='SECONDS', type=float, default=None,
+                        help='Kill the clones and fetches without progress for SECONDS.')
+    parse.add_argument('--timeout-retries', dest='timeout_retries', metavar='N', type=int, default=0,
+                        help='Retry N times the timed out git commands, with a new connection.')
+    parse.add_argument('--log-format', dest='log_format', choices=EventLog.FORMATS, default='text',
+                        help='Format of the log. "json" writes one event per phase with the repo, ref, '
+                        'sha and duration. Default value is "text".')
+    parse.add_argument('--log-level', dest='log_level', choices=sorted(EventLog.LEVELS, key=EventLog.LEVELS.get),
+                        default='INFO', help='Lowest level of the messages logged. Default value is "INFO".')
+    parse.add_argument('--prefetch-store', dest='prefetch_store', metavar='DIR', required=prefetch,
+                        help='Directory where "copy_.py prefetch" fetches the objects. If the repository '
+                        'was prefetched with the same branches, clone from it without network.')
+    parse.add_argument('--dest', dest='dests', metavar='DIR', action='append', default=[],
+                        help='Directory of the prepared tree. Can be repeated: the tree is prepared '
+                        'once in the first DIR and copied to the others.')
+    parse.add_argument('--dest-mode', dest='dest_mode', choices=COPY_MODES, default='auto',
+                        help='How the tree is copied to the extra destinations: "auto" uses copy-on-write '
+                        'reflinks where the filesystem supports them, "hardlink" shares the files (for '
+                        'read-only consumers), both fall back to a parallel copy. Default value is "auto".')
+    if prefetch:
+        parse.add_argument('--background', action='store_true',
+                            help='Prefetch in a detached process and return at once.')
+        parse.add_argument('--maintain', action='store_true',
+                            help='Run the maintenance tasks (see "copy_.py maintain --help") on the '
+                            'prefetched repository after the fetch.')
+        parse.add_argument('--maintenance-budget', dest='maintenance_budget', type=float, default=None,
+                            help='Seconds available for the maintenance tasks.')
+
+    # Return the variables, a single origin branch as a str
+    data = parse.parse_args(args)
+    data.origin = [branch for branch in data.origin or [] if branch]
+    if not data.origin:
+        data.origin = None
+    elif len(data.origin) == 1:
+        data.origin = data.origin[0]
+    return data
+
+def validate_args(args=None, prefetch=False):
     '''
     Check the arguments args passed and determine the branches names and 
     travis action type. If some branch name or travis action type is 'None' take 
@@ -602,11 +2586,13 @@ def validate_args(args=None):
     Parameters:
         args: list, default None.
             See function 'get_parse_args' for args parse.
+        prefetch: bool, default False.
+            If is True validate the arguments of the 'prefetch' command.
         
     Return:
         A namespace with the arguments parse.
     '''
-    args = get_parse_args(args)
+    args = get_parse_args(args, prefetch=prefetch)
     
     if args.default == None:
         args.default = DEFAULT_BRANCH
@@ -625,27 +2611,80 @@ def validate_args(args=None):
     else: 
         args.travis_action_type = TRAVIS_TYPE_PR
 
+    # A push can have several commits, the range is 'FIRST...LAST' or 'FIRST..LAST'. It 
+    # belongs to the repository that triggered the build, not to the others copied
+    if (args.changes_out and args.changes_base == None and args.travis_action_type == TRAVIS_TYPE_PUSH
+            and is_build_repository(args.url)):
+        commit_range = get_env_var(TRAVIS_COMMIT_RANGE)
+        args.changes_base = re.split(r'\.\.\.?', commit_range)[0] if commit_range else None
+
     return args
 
 def main():
+
+    # Run the command, if the first argument is one of COMMANDS
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
     
+    # Set the log before the arguments are validated, it logs the env vars found.
+    options = get_parse_args(sys.argv[1:])
+    LOG.configure(log_format=options.log_format, level=options.log_level)
+
     # Take the arguments from command-line and set the variables.
     data = validate_args(sys.argv[1:])
     travis_repo = TravisRepoAction(url=data.url,
-                                path=None,
-                                clone_repo=True,
+                                path=data.dests[0] if data.dests else None,
+                                clone_repo=not data.lock_in,
                                 target_branch=data.target,
                                 origin_branch=data.origin,
                                 default_branch=data.default,
-                                action_type=data.travis_action_type)
+                                action_type=data.travis_action_type,
+                                submodules=data.submodules,
+                                submodule_jobs=data.submodule_jobs,
+                                shallow_submodules=data.shallow_submodules,
+                                governor=HostGovernor(max_per_host=data.max_per_host),
+                                checkout_workers=data.checkout_workers,
+                                seed_bundle=data.seed_bundle,
+                                bundle_max_age=data.bundle_max_age,
+                                watchdog=GitWatchdog(timeouts=dict(data.timeouts),
+                                                    stall_timeout=data.stall_timeout,
+                                                    retries=data.timeout_retries),
+                                prefetch_store=data.prefetch_store,
+                                octopus=data.octopus)
+
+    # Run the TravisCI test, or replay the commits of the lock file
+    if data.lock_in:
+        travis_repo.replay(read_lock_file(data.lock_in, data.url))
+    else:
+        travis_repo.set_credentials()
+        travis_repo.run()
+
+    if data.lock_out:
+        write_lock_file(data.lock_out, data.url, travis_repo.get_lock_entry())
+
+    if data.changes_out:
+        changes = travis_repo.get_changed_files(base=data.changes_base)
+        write_json(data.changes_out, changes)
+        print_colored("{0} changed paths written in {1}.".format(len(changes['files']), data.changes_out))
+
+    if data.manifest_out:
+        manifest = travis_repo.get_tree_manifest()
+        write_json(data.manifest_out, manifest)
+        print_colored("{0} blobs and {1} trees written in {2}.".format(len(manifest['blobs']),
+                                                                    len(manifest['trees']),
+                                                                    data.manifest_out))
 
-    # Run the TravisCI test
-    travis_repo.set_credentials()
-    travis_repo.run()
     travis_repo.del_git_file()
+    travis_repo.materialize(data.dests[1:], mode=data.dest_mode)
     
     del travis_repo
 
+COMMANDS = {
+    'bundle': bundle,
+    'maintain': maintain,
+    'prefetch': prefetch,
+}
+
 if __name__ == "__main__":
 
     main()
\ No newline at end of file
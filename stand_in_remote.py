@@ -0,0 +1,338 @@
+'''
+Local stand-in of a git remote, to time and stress-test the clone and fetch
+strategies of copy_.py without network.
+
+The repositories in a root directory are served over smart HTTP with
+'git http-backend', behind a throttle that injects the network conditions:
+    latency: seconds waited before each response (one round trip per request).
+    bandwidth: bytes per second of the responses.
+    stall_after: bytes of the response sent before the connection hangs.
+    reset_after: bytes of the response sent before the connection is reset.
+    faults: number of responses stalled or reset, the next ones are served normally
+            (so the retries can be tested). If None, all of them.
+
+The StandInRemote class is used by the pytest fixture 'stand_in_remote' (see
+conftest.py), and the module is a command-line tool too:
+
+    python stand_in_remote.py /srv/repos --port 8000 --latency 0.1 --bandwidth 1000000
+    python copy_.py http://127.0.0.1:8000/myrepo -t development
+
+Run 'python stand_in_remote.py --help' for more information.
+
+FUNCTIONS:
+    get_parse_args
+    main
+
+CLASSES:
+    StandInHandler
+    StandInRemote
+    StandInServer
+'''
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote
+import os, time, socket, struct, threading, subprocess, argparse
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    '''
+    HTTP server with a thread per request. The remote attribute stores the StandInRemote
+    that configures the requests.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+    Serve the git smart HTTP requests with 'git http-backend', injecting the network
+    conditions of the StandInRemote of the server.
+    '''
+
+    def do_GET(self):
+        self.serve_git()
+
+    def do_POST(self):
+        self.serve_git()
+
+    def log_message(self, format, *args):
+        if self.server.remote.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def read_body(self):
+        '''
+        Return the body of the request, with Content-Length or chunked.
+        '''
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                self.rfile.readline()
+                return b''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def run_backend(self, body):
+        '''
+        Run 'git http-backend' for the request with body, and return the tuple
+        (status, headers, content) of its CGI response.
+        '''
+        path, _, query = self.path.partition('?')
+        env = dict(os.environ,
+                GIT_PROJECT_ROOT=self.server.remote.root,
+                GIT_HTTP_EXPORT_ALL='1',
+                PATH_INFO=unquote(path),
+                QUERY_STRING=query,
+                REQUEST_METHOD=self.command,
+                CONTENT_TYPE=self.headers.get('Content-Type', ''),
+                CONTENT_LENGTH=str(len(body)),
+                REMOTE_ADDR=self.client_address[0])
+        for header, variable in (('Content-Encoding', 'HTTP_CONTENT_ENCODING'), ('Git-Protocol', 'GIT_PROTOCOL')):
+            if self.headers.get(header):
+                env[variable] = self.headers.get(header)
+
+        process = subprocess.Popen(['git', 'http-backend'], env=env, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = process.communicate(body)[0]
+
+        separator = b'\r\n\r\n' if b'\r\n\r\n' in output else b'\n\n'
+        head, _, content = output.partition(separator)
+        status, headers = '200 OK', []
+        for line in head.decode('latin-1').splitlines():
+            name, _, value = line.partition(':')
+            if name.lower() == 'status':
+                status = value.strip()
+            elif name:
+                headers.append((name, value.strip()))
+
+        return status, headers, content
+
+    def serve_git(self):
+        '''
+        Answer the request after latency, sending the response at bandwidth, and stall
+        or reset the connection if the response is longer than stall_after or reset_after
+        and there are faults left.
+        '''
+        remote = self.server.remote
+        remote.count_request()
+        status, headers, content = self.run_backend(self.read_body())
+
+        response = ['HTTP/1.0 {}'.format(status)]
+        response.extend('{0}: {1}'.format(name, value) for name, value in headers)
+        response.append('Content-Length: {}'.format(len(content)))
+        response = ('\r\n'.join(response) + '\r\n\r\n').encode('latin-1') + content
+        self.close_connection = True
+
+        time.sleep(remote.latency)
+        limit = len(response)
+        if remote.stall_after is not None:
+            limit = min(limit, remote.stall_after)
+        if remote.reset_after is not None:
+            limit = min(limit, remote.reset_after)
+        if limit < len(response) and not remote.take_fault():
+            limit = len(response)
+
+        self.send_throttled(response[:limit])
+        if limit == len(response):
+            return
+
+        if remote.reset_after is not None and limit == remote.reset_after:
+            # Close with a RST instead of a FIN
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+        else:
+            remote.stopped.wait()
+
+    def send_throttled(self, data):
+        '''
+        Send data limited to the bandwidth of the remote.
+        '''
+        bandwidth = self.server.remote.bandwidth
+        chunk_size = max(1, int(bandwidth / 20)) if bandwidth else len(data) or 1
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            self.wfile.write(chunk)
+            self.server.remote.count_bytes(len(chunk))
+            if bandwidth:
+                time.sleep(len(chunk) / float(bandwidth))
+
+class StandInRemote():
+    '''
+    Serve the git repositories of root over smart HTTP in a background thread, with
+    the network conditions injected (see the module documentation). The conditions
+    attributes can be changed while it is running, they apply to the next requests.
+
+    Parameters:
+        root: str.
+            The directory of the repositories, created if it does not exist. The
+            repository 'root/name' (bare or not) is served at url('name').
+        host: str, default '127.0.0.1'.
+            The address listened.
+        port: int, default 0.
+            The port listened. If 0, a free port.
+        latency: float, default 0.
+            The seconds waited before each response.
+        bandwidth: float, default None.
+            The bytes per second of the responses. If None, not limited.
+        stall_after: int, default None.
+            The bytes sent before the connection hangs (until stop).
+        reset_after: int, default None.
+            The bytes sent before the connection is reset.
+        faults: int, default None.
+            The number of responses stalled or reset. If None, all of them.
+        verbose: bool, default False.
+            If is True log the requests in stderr.
+
+    Attributes:
+        root, host, latency, bandwidth, stall_after, reset_after, faults, verbose.
+            Store the parameters.
+        port: int.
+            Store the port listened, once started.
+        requests: int.
+            Store the number of requests received.
+        bytes_sent: int.
+            Store the number of bytes sent.
+        stopped: threading.Event.
+            Set when the remote is stopped, it releases the stalled connections.
+    '''
+
+    def __init__(self,
+                root,
+                host='127.0.0.1',
+                port=0,
+                latency=0,
+                bandwidth=None,
+                stall_after=None,
+                reset_after=None,
+                faults=None,
+                verbose=False):
+
+        self.root = os.path.abspath(root)
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stall_after = stall_after
+        self.reset_after = reset_after
+        self.faults = faults
+        self.verbose = verbose
+        self.requests = 0
+        self.bytes_sent = 0
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.server = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        '''
+        Listen and serve the requests in a background thread, and return self.
+        '''
+        self.server = StandInServer((self.host, self.port), StandInHandler)
+        self.server.remote = self
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stop serving, releasing the stalled connections.
+        '''
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def url(self, name):
+        '''
+        Return the url of the repository name of root attribute.
+        '''
+        return 'http://{0}:{1}/{2}'.format(self.host, self.port, name)
+
+    def count_request(self):
+        '''
+        Count a new request.
+        '''
+        with self.lock:
+            self.requests += 1
+
+    def take_fault(self):
+        '''
+        Return True if there are faults left (see faults attribute), and count one.
+        '''
+        with self.lock:
+            if self.faults is None:
+                return True
+            if self.faults > 0:
+                self.faults -= 1
+                return True
+            return False
+
+    def count_bytes(self, size):
+        '''
+        Count size bytes sent.
+        '''
+        with self.lock:
+            self.bytes_sent += size
+
+def get_parse_args(args=None):
+    '''
+    Implement the command-line arguments. The options are:
+     root (positional): Directory of the repositories.
+     [--host] (optional): Address listened.
+     [--port] (optional): Port listened.
+     [--latency] (optional): Seconds waited before each response.
+     [--bandwidth] (optional): Bytes per second of the responses.
+     [--stall-after] (optional): Bytes sent before the connection hangs.
+     [--reset-after] (optional): Bytes sent before the connection is reset.
+     [--faults] (optional): Number of responses stalled or reset.
+     [--verbose] (optional): Log the requests.
+    '''
+    parse = argparse.ArgumentParser(description='Serve the git repositories of a directory over smart '
+                                    'HTTP with injected latency, bandwidth, stalls and resets.')
+    parse.add_argument('root', help='Directory of the repositories, "ROOT/NAME" is served at "/NAME".')
+    parse.add_argument('--host', default='127.0.0.1', help='Address listened. Default value is "127.0.0.1".')
+    parse.add_argument('--port', type=int, default=8000, help='Port listened. Default value is 8000.')
+    parse.add_argument('--latency', metavar='SECONDS', type=float, default=0,
+                        help='Seconds waited before each response.')
+    parse.add_argument('--bandwidth', metavar='BYTES', type=float, default=None,
+                        help='Bytes per second of the responses.')
+    parse.add_argument('--stall-after', dest='stall_after', metavar='BYTES', type=int, default=None,
+                        help='Hang the connection after sending BYTES of the response.')
+    parse.add_argument('--reset-after', dest='reset_after', metavar='BYTES', type=int, default=None,
+                        help='Reset the connection after sending BYTES of the response.')
+    parse.add_argument('--faults', metavar='N', type=int, default=None,
+                        help='Stall or reset only N responses. Default all of them.')
+    parse.add_argument('--verbose', action='store_true', help='Log the requests.')
+
+    return parse.parse_args(args)
+
+def main():
+    data = get_parse_args()
+    remote = StandInRemote(data.root,
+                        host=data.host,
+                        port=data.port,
+                        latency=data.latency,
+                        bandwidth=data.bandwidth,
+                        stall_after=data.stall_after,
+                        reset_after=data.reset_after,
+                        faults=data.faults,
+                        verbose=data.verbose).start()
+    print("Serving {0} at {1}".format(remote.root, remote.url('')))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        remote.stop()
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 import pytest
 from git import Repo
 from copy_ import *
-import os, shutil
+import os, shutil, time
 import random
 
 URL_GEPPETTO = 'https://github.com/openworm/org.geppetto.git'
@@ -14,6 +14,44 @@ URL_LIST = ['https://github.com/openworm/org.geppetto.git',
             'https://github.com/openworm/geppetto-application.git']
 
 
+def make_local_repo(path, files=None):
+    '''
+    Create a repository in path with one commit on master adding files, a dict 
+    {name: content}, and return the git.Repo.
+    '''
+    repo = Repo.init(path)
+    repo.git.checkout('-b', 'master')
+    repo.config_writer().set_value("user", "name", "Test").release()
+    repo.config_writer().set_value("user", "email", "test@example.com").release()
+    commit_files(repo, files or {'README.md': 'readme\n'}, 'Initial commit')
+    return repo
+
+def commit_files(repo, files, message):
+    '''
+    Write files, a dict {name: content}, in the working tree of repo and commit them.
+    '''
+    for name, content in files.items():
+        file_path = os.path.join(repo.working_tree_dir, name)
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'w') as f:
+            f.write(content)
+    repo.git.add(*files.keys())
+    repo.git.commit('-m', message)
+    return repo.head.commit.hexsha
+
+def write_hook(hooks_dir, name, script):
+    '''
+    Write the executable git hook name with the shell script in hooks_dir.
+    '''
+    if not os.path.isdir(hooks_dir):
+        os.makedirs(hooks_dir)
+    hook_path = os.path.join(hooks_dir, name)
+    with open(hook_path, 'w') as f:
+        f.write('#!/bin/sh\n' + script + '\n')
+    os.chmod(hook_path, 0o755)
+    return hook_path
+
 def gen_random_branch(branch):
 
     lst = list(branch)
@@ -351,3 +389,1079 @@ class TestTravisRepoActionPr():
         del_path = travis_repo.path
         del travis_repo
         shutil.rmtree(del_path)
+
+#2 Test
+class TestTravisRepoActionSubmodules():
+
+    def test_push_update_submodules(self, tmp_path, monkeypatch):
+        # Allow local submodule urls (git >= 2.38.1 forbids them by default)
+        monkeypatch.setenv('GIT_CONFIG_COUNT', '1')
+        monkeypatch.setenv('GIT_CONFIG_KEY_0', 'protocol.file.allow')
+        monkeypatch.setenv('GIT_CONFIG_VALUE_0', 'always')
+
+        lib = make_local_repo(str(tmp_path / 'lib'), {'lib.py': 'lib\n'})
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        origin.git.submodule('add', lib.working_tree_dir, 'vendor/lib')
+        origin.git.commit('-m', 'Add lib submodule')
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master',
+                                        submodules=True,
+                                        submodule_jobs=2)
+
+        assert travis_repo.push()
+        assert os.path.isfile(str(tmp_path / 'clone' / 'vendor' / 'lib' / 'lib.py'))
+        assert travis_repo.get_submodule_paths() == ['vendor/lib']
+
+        travis_repo.del_git_file()
+        assert not os.path.exists(str(tmp_path / 'clone' / '.git'))
+        assert not os.path.exists(str(tmp_path / 'clone' / 'vendor' / 'lib' / '.git'))
+
+    def test_submodules_disabled(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master')
+
+        assert travis_repo.push()
+        assert not travis_repo.update_submodules()
+
+#4 Test
+class TestTravisRepoActionLockFile():
+
+    def make_origin(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'), {'a.txt': 'a\n'})
+        origin.git.checkout('-b', 'development')
+        commit_files(origin, {'b.txt': 'b\n'}, 'Add b')
+        origin.git.checkout('-b', 'feature/1', 'master')
+        commit_files(origin, {'c.txt': 'c\n'}, 'Add c')
+        origin.git.checkout('master')
+        return origin
+
+    def test_lock_entry_pr(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='development',
+                                        origin_branch='feature/1',
+                                        action_type='pr')
+        travis_repo.set_credentials()
+        travis_repo.run()
+
+        entry = travis_repo.get_lock_entry()
+        assert entry['target_ref'] == 'development'
+        assert entry['target'] == origin.commit('development').hexsha
+        assert entry['origin'] == origin.commit('feature/1').hexsha
+        assert entry['tag'] is None
+        assert entry['merge'] == travis_repo.repo.head.commit.hexsha
+        assert entry['merge_tree'] == travis_repo.repo.head.commit.tree.hexsha
+
+    def test_lock_entry_push_default(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='no-exist',
+                                        default_branch='development')
+        travis_repo.run()
+
+        entry = travis_repo.get_lock_entry()
+        assert entry['target_ref'] == 'development'
+        assert entry['target'] == entry['merge'] == origin.commit('development').hexsha
+        assert entry['origin'] is None
+
+    def test_write_and_replay_lock_file(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        url = origin.working_tree_dir
+        lock_path = str(tmp_path / 'copy.lock')
+        travis_repo = TravisRepoAction(url,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='development',
+                                        origin_branch='feature/1',
+                                        action_type='pr')
+        travis_repo.set_credentials()
+        travis_repo.run()
+        write_lock_file(lock_path, url, travis_repo.get_lock_entry())
+        write_lock_file(lock_path, 'other-url', {'target': 'sha'})
+        entry = read_lock_file(lock_path, url)
+
+        # Move the branches after the lock
+        origin.git.checkout('development')
+        commit_files(origin, {'d.txt': 'd\n'}, 'Add d')
+
+        replayed = TravisRepoAction(url, path=str(tmp_path / 'replay'))
+        replayed.replay(entry)
+
+        assert str(replayed.repo.active_branch) == 'development'
+        assert replayed.repo.head.commit.tree.hexsha == entry['merge_tree']
+        assert replayed.repo.head.commit.parents[0].hexsha == entry['target']
+        assert not os.path.exists(str(tmp_path / 'replay' / 'd.txt'))
+
+        with pytest.raises(LockFileError):
+            read_lock_file(lock_path, 'no-recorded-url')
+
+    def test_concurrent_lock_file_writers(self, tmp_path):
+        import threading
+
+        lock_path = str(tmp_path / 'copy.lock')
+        writers = [threading.Thread(target=write_lock_file, args=(lock_path, 'url{}'.format(index), {'target': index}))
+                    for index in range(20)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        for index in range(20):
+            assert read_lock_file(lock_path, 'url{}'.format(index)) == {'target': index}
+        assert os.listdir(str(tmp_path)) == ['copy.lock']
+
+#3 Test
+class TestTravisRepoActionChangedFiles():
+
+    def test_changed_files_pr(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'), {'README.md': 'readme\n', 'src/a.py': 'a\n'})
+        origin.git.checkout('-b', 'feature/1')
+        commit_files(origin, {'src/a.py': 'a2\n', 'src/b.py': 'b\n', 'docs/index.md': 'doc\n'}, 'Change')
+        origin.git.rm('README.md')
+        origin.git.commit('-m', 'Remove readme')
+        origin.git.checkout('master')
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master',
+                                        origin_branch='feature/1',
+                                        action_type='pr')
+        travis_repo.set_credentials()
+        travis_repo.run()
+        changes = travis_repo.get_changed_files()
+
+        assert changes['base'] == origin.commit('master').hexsha
+        assert changes['head'] == travis_repo.repo.head.commit.hexsha
+        assert sorted((f['status'], f['path']) for f in changes['files']) == [
+            ('A', 'docs/index.md'), ('A', 'src/b.py'), ('D', 'README.md'), ('M', 'src/a.py')]
+        assert changes['directories'] == {'.': 1, 'docs': 1, 'src': 2}
+
+    def test_changed_files_push(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        commit_files(origin, {'lib/c.py': 'c\n'}, 'Add c')
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master')
+        travis_repo.run()
+        changes = travis_repo.get_changed_files()
+
+        assert changes['base'] == origin.commit('master~1').hexsha
+        assert changes['files'] == [{'status': 'A', 'path': 'lib/c.py'}]
+        assert changes['directories'] == {'lib': 1}
+
+    def test_changed_files_push_range(self, tmp_path, monkeypatch):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        first = origin.head.commit.hexsha
+        commit_files(origin, {'lib/c.py': 'c\n'}, 'Add c')
+        commit_files(origin, {'app/d.py': 'd\n'}, 'Add d')
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master')
+        travis_repo.run()
+
+        # All the commits of the push are included
+        changes = travis_repo.get_changed_files(base=first)
+        assert changes['base'] == first
+        assert changes['directories'] == {'app': 1, 'lib': 1}
+        # Unknown base, every path is changed
+        assert len(travis_repo.get_changed_files(base='f' * 40)['files']) == 3
+
+        monkeypatch.setenv('TRAVIS_COMMIT_RANGE', first + '...' + origin.head.commit.hexsha)
+        monkeypatch.setenv('TRAVIS_REPO_SLUG', 'openworm/org.geppetto')
+        data = validate_args([URL_GEPPETTO, '--push', '--changes-out', 'changes.json'])
+        assert data.changes_base == first
+        # The range of the repository that triggered the build is not used for the others
+        data = validate_args([URL_LIST[1], '--push', '--changes-out', 'changes.json'])
+        assert data.changes_base is None
+
+#1 Test
+class TestTravisRepoActionManifest():
+
+    def test_tree_manifest(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'),
+                                {'README.md': 'readme\n', 'src/a.py': 'a\n', 'src/pkg/b.py': 'b\n'})
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master')
+        travis_repo.run()
+        manifest = travis_repo.get_tree_manifest()
+        head = origin.head.commit
+
+        assert manifest['commit'] == head.hexsha
+        assert manifest['blobs'] == {'README.md': (head.tree / 'README.md').hexsha,
+                                    'src/a.py': (head.tree / 'src/a.py').hexsha,
+                                    'src/pkg/b.py': (head.tree / 'src/pkg/b.py').hexsha}
+        assert manifest['trees'] == {'.': head.tree.hexsha,
+                                    'src': (head.tree / 'src').hexsha,
+                                    'src/pkg': (head.tree / 'src/pkg').hexsha}
+        assert manifest['submodules'] == {}
+
+#5 Test
+class TestHostGovernor():
+
+    def test_get_url_host(self):
+        assert get_url_host(URL_GEPPETTO) == 'github.com'
+        assert get_url_host('https://user@GitHub.com:443/openworm/org.geppetto.git') == 'github.com'
+        assert get_url_host('git@github.com:openworm/org.geppetto.git') == 'github.com'
+        assert get_url_host('ssh://git@github.com/openworm/org.geppetto.git') == 'github.com'
+        assert get_url_host('/tmp/org.geppetto') is None
+        assert get_url_host('file:///tmp/org.geppetto') is None
+
+    def test_get_env(self, tmp_path):
+        governor = HostGovernor(lock_dir=str(tmp_path))
+
+        assert governor.get_env(URL_GEPPETTO) == {}
+        ssh_command = governor.get_env('git@github.com:openworm/org.geppetto.git')['GIT_SSH_COMMAND']
+        assert 'ControlMaster=auto' in ssh_command
+        assert str(tmp_path) in ssh_command
+
+    def test_slot_limits_concurrency(self, tmp_path):
+        import threading
+
+        governor = HostGovernor(max_per_host=2, lock_dir=str(tmp_path), poll_interval=0.01)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def operation():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        threads = [threading.Thread(target=governor.run, args=(URL_GEPPETTO, operation)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(peak) == 6
+        assert max(peak) == 2
+
+    def test_retry_on_rate_limit(self, tmp_path):
+        governor = HostGovernor(lock_dir=str(tmp_path), retries=2, backoff=0.01)
+        calls = []
+
+        def operation():
+            calls.append(1)
+            if len(calls) < 3:
+                raise Exception('error: RPC failed; HTTP 429 curl 22 The requested URL returned error: 429')
+            return 'done'
+
+        assert governor.run(URL_GEPPETTO, operation) == 'done'
+        assert len(calls) == 3
+
+    def test_no_retry_on_other_errors(self, tmp_path):
+        governor = HostGovernor(lock_dir=str(tmp_path), retries=2, backoff=0.01)
+        calls = []
+
+        def operation():
+            calls.append(1)
+            raise Exception('Repository not found.')
+
+        with pytest.raises(Exception):
+            governor.run(URL_GEPPETTO, operation)
+        assert len(calls) == 1
+
+#4 Test
+class TestMaintainRepository():
+
+    def make_clone(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True)
+        for index in range(3):
+            commit_files(origin, {'file{}.txt'.format(index): 'content\n'}, 'Commit {}'.format(index))
+            travis_repo.repo.git.fetch('origin')
+        return travis_repo
+
+    def test_maintain_repository(self, tmp_path):
+        travis_repo = self.make_clone(tmp_path)
+        timings = maintain_repository(travis_repo.path)
+        objects = os.path.join(travis_repo.path, '.git', 'objects')
+
+        assert sorted(timings['tasks']) == ['bitmaps', 'commit-graph', 'loose-objects',
+                                            'multi-pack-index', 'prune']
+        assert sorted(timings['before']) == sorted(timings['after']) == ['fetch', 'merge-base']
+        assert os.path.exists(os.path.join(objects, 'info', 'commit-graph')) or \
+            os.path.isdir(os.path.join(objects, 'info', 'commit-graphs'))
+        assert os.path.exists(os.path.join(objects, 'pack', 'multi-pack-index'))
+        assert len([f for f in os.listdir(os.path.join(objects, 'pack')) if f.endswith('.pack')]) == 1
+
+    def test_maintain_repository_budget(self, tmp_path):
+        travis_repo = self.make_clone(tmp_path)
+        timings = maintain_repository(travis_repo.path, budget=0, time_fetch=False)
+
+        assert timings['tasks'] == {}
+        assert list(timings['before']) == ['merge-base']
+
+    def test_time_bare_repository(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        origin.git.checkout('-b', 'development')
+        commit_files(origin, {'a.txt': 'a\n'}, 'Add a')
+        store = str(tmp_path / 'store')
+        prefetch_repository(origin.working_tree_dir, store, ['master', 'development'], default_branch='master')
+        repo = Repo(get_prefetch_paths(origin.working_tree_dir, store)[0])
+
+        assert get_merge_base_ref(repo) == 'refs/heads/development'
+        assert list(time_repository(repo, time_fetch=False)) == ['merge-base']
+
+    def test_maintain_after_bundle_and_prefetch_fetch(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        commit_files(origin, {'a.txt': 'a\n'}, 'Add a')
+
+        create_bundle(origin.working_tree_dir, str(tmp_path / 'bundles'), maintain=True)
+        prefetch_repository(origin.working_tree_dir, str(tmp_path / 'store'), ['master'], maintain=True)
+
+        for repo_dir in [str(tmp_path / 'bundles' / 'origin.git'),
+                        get_prefetch_paths(origin.working_tree_dir, str(tmp_path / 'store'))[0]]:
+            assert os.path.exists(os.path.join(repo_dir, 'objects', 'pack', 'multi-pack-index'))
+
+#2 Test
+class TestTravisRepoActionParallelCheckout():
+
+    FILES = 2000
+
+    def make_origin(self, tmp_path):
+        # Synthetic tree with many files, all changed in the 'development' branch
+        origin = make_local_repo(str(tmp_path / 'origin'),
+                                dict(('dir{0}/file{1}.txt'.format(i % 20, i), 'v1 {}\n'.format(i))
+                                    for i in range(self.FILES)))
+        origin.git.checkout('-b', 'development')
+        commit_files(origin, dict(('dir{0}/file{1}.txt'.format(i % 20, i), 'v2 {}\n'.format(i))
+                                for i in range(self.FILES)), 'Change all the files')
+        origin.git.checkout('master')
+        return origin
+
+    def test_parallel_checkout(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='development',
+                                        checkout_workers=4)
+
+        assert travis_repo.repo.git.config('checkout.workers') == '4'
+        # Only the number of workers is configured, the other settings are git's defaults
+        with pytest.raises(GitCommandError):
+            travis_repo.repo.git.config('core.preloadIndex')
+
+        assert travis_repo.push()
+        assert travis_repo.stats['checkout']['files'] == self.FILES
+        with open(str(tmp_path / 'clone' / 'dir7' / 'file7.txt')) as f:
+            assert f.read() == 'v2 7\n'
+
+    def test_parallel_checkout_auto_workers(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('GIT_CONFIG_COUNT', '1')
+        monkeypatch.setenv('GIT_CONFIG_KEY_0', 'user.name')
+        monkeypatch.setenv('GIT_CONFIG_VALUE_0', 'Env')
+        origin = self.make_origin(tmp_path)
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master',
+                                        origin_branch='development',
+                                        action_type='pr',
+                                        checkout_workers=0)
+
+        assert travis_repo.repo.git.config('checkout.workers') == str(os.cpu_count())
+        # The configuration already in the environment is kept
+        assert travis_repo.repo.git.config('user.name') == 'Env'
+
+        assert travis_repo.pr()
+        assert travis_repo.stats['merge']['files'] == self.FILES
+
+#5 Test
+class TestTrashCollector():
+
+    def make_tree(self, path, files=200):
+        for index in range(files):
+            directory = os.path.join(path, 'dir{}'.format(index % 10))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(os.path.join(directory, 'file{}'.format(index)), 'w') as f:
+                f.write('content')
+        os.symlink(os.path.join(path, 'dir0'), os.path.join(path, 'link'))
+
+    def test_discard(self, tmp_path):
+        path = str(tmp_path / 'to_delete')
+        self.make_tree(path)
+        trash = TrashCollector(workers=4)
+
+        trash.discard(path)
+        assert not os.path.exists(path)
+
+        trash.wait()
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_discard_while_deleting(self, tmp_path):
+        # The pending deletions remove the shared trash directory while the next ones are discarded
+        trash = TrashCollector()
+        for index in range(500):
+            path = str(tmp_path / 'dir{}'.format(index))
+            os.makedirs(path)
+            trash.discard(path)
+
+        trash.wait()
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_discard_trash_file(self, tmp_path):
+        path = str(tmp_path / 'to_delete')
+        self.make_tree(path)
+        with open(str(tmp_path / TrashCollector.TRASH_NAME), 'w') as f:
+            f.write('not a directory')
+
+        # The trash directory can not be created, so path is deleted before return
+        TrashCollector().discard(path)
+        assert os.listdir(str(tmp_path)) == [TrashCollector.TRASH_NAME]
+
+    def test_discard_trash_root(self, tmp_path):
+        path = str(tmp_path / 'repo' / '.git')
+        self.make_tree(path)
+        trash = TrashCollector()
+
+        trash.discard(path, trash_root=str(tmp_path))
+        # The trash directory is not created inside the repository
+        assert os.listdir(str(tmp_path / 'repo')) == []
+
+        trash.wait()
+        assert os.listdir(str(tmp_path)) == ['repo']
+
+    def test_clone_and_del_git_file(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        trash = TrashCollector()
+        os.makedirs(str(tmp_path / 'clone' / 'old'))
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master',
+                                        trash=trash)
+        assert not os.path.exists(str(tmp_path / 'clone' / 'old'))
+
+        travis_repo.run()
+        travis_repo.del_git_file()
+        assert os.listdir(str(tmp_path / 'clone')) == ['README.md']
+
+        trash.wait()
+        assert sorted(os.listdir(str(tmp_path))) == ['clone', 'origin']
+
+#5 Test
+class TestTravisRepoActionSeedBundle():
+
+    def make_origin(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'), {'a.txt': 'a\n'})
+        origin.git.checkout('-b', 'development')
+        commit_files(origin, {'b.txt': 'b\n'}, 'Add b')
+        origin.git.checkout('master')
+        return origin
+
+    def clone(self, origin, tmp_path, **kwargs):
+        return TravisRepoAction(origin.working_tree_dir,
+                                path=str(tmp_path / 'clone'),
+                                clone_repo=True,
+                                target_branch='development',
+                                **kwargs)
+
+    def test_create_bundle(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        bundle_path = create_bundle(origin.working_tree_dir, str(tmp_path / 'bundles'))
+
+        assert bundle_path == os.path.abspath(str(tmp_path / 'bundles' / 'origin.bundle'))
+        heads = origin.git.bundle('list-heads', bundle_path)
+        assert origin.commit('development').hexsha + ' refs/heads/development' in heads
+
+        # Refresh the bundle with a new commit
+        commit_files(origin, {'c.txt': 'c\n'}, 'Add c')
+        create_bundle(origin.working_tree_dir, str(tmp_path / 'bundles'))
+        heads = origin.git.bundle('list-heads', bundle_path)
+        assert origin.commit('master').hexsha + ' refs/heads/master' in heads
+        # The temporary bundles are renamed
+        assert sorted(os.listdir(str(tmp_path / 'bundles'))) == ['origin.bundle', 'origin.git']
+
+    def test_clone_from_bundle_and_fetch_delta(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        create_bundle(origin.working_tree_dir, str(tmp_path / 'bundles'))
+        # Commits newer than the bundle
+        commit_files(origin, {'c.txt': 'c\n'}, 'Add c')
+        origin.git.branch('feature/new')
+
+        travis_repo = self.clone(origin, tmp_path, seed_bundle=str(tmp_path / 'bundles'))
+
+        assert 'clone: from ' + str(tmp_path / 'bundles' / 'origin.bundle') in travis_repo.repo.git.reflog()
+        assert travis_repo.repo.git.config('remote.origin.url') == origin.working_tree_dir
+        assert travis_repo.repo.head.commit.hexsha == origin.commit('master').hexsha
+        assert travis_repo.is_repo_branch('feature/new')
+
+        assert travis_repo.push()
+        assert str(travis_repo.repo.active_branch) == 'development'
+
+    def test_stale_bundle_fallback(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        bundle_path = create_bundle(origin.working_tree_dir, str(tmp_path / 'bundles'))
+        os.utime(bundle_path, (time.time() - 10 * 86400, time.time() - 10 * 86400))
+
+        travis_repo = self.clone(origin, tmp_path, seed_bundle=bundle_path)
+
+        assert travis_repo.find_seed_bundle() is None
+        assert 'clone: from ' + origin.working_tree_dir in travis_repo.repo.git.reflog()
+
+    def test_broken_bundle_fallback(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        bundle_path = str(tmp_path / 'origin.bundle')
+        with open(bundle_path, 'w') as f:
+            f.write('not a bundle')
+
+        travis_repo = self.clone(origin, tmp_path, seed_bundle=bundle_path)
+
+        assert travis_repo.find_seed_bundle() == bundle_path
+        assert 'clone: from ' + origin.working_tree_dir in travis_repo.repo.git.reflog()
+        assert travis_repo.push()
+
+    def test_seeded_fetch_timeout(self, tmp_path, stand_in_remote):
+        origin = self.make_origin(tmp_path)
+        bundle_path = create_bundle(origin.working_tree_dir, str(tmp_path / 'bundles'))
+        make_local_repo(os.path.join(stand_in_remote.root, 'stalled'))
+        stand_in_remote.stall_after = 0
+
+        with pytest.raises(GitTimeout):
+            TravisRepoAction(stand_in_remote.url('stalled'),
+                            path=str(tmp_path / 'clone'),
+                            clone_repo=True,
+                            target_branch='development',
+                            seed_bundle=bundle_path,
+                            watchdog=GitWatchdog(timeouts={'fetch': 1}))
+        # Not cloned again from the url that hung
+        assert stand_in_remote.requests == 1
+        assert not os.path.exists(str(tmp_path / 'clone'))
+
+#8 Test
+class TestGitWatchdog():
+
+    @pytest.fixture
+    def stalled_url(self, stand_in_remote):
+        # Stand-in remote that accepts the requests and never answers
+        make_local_repo(os.path.join(stand_in_remote.root, 'stalled'))
+        stand_in_remote.stall_after = 0
+        return stand_in_remote.url('stalled'), stand_in_remote
+
+    def test_execute_output(self, tmp_path):
+        make_local_repo(str(tmp_path / 'repo'))
+        watchdog = GitWatchdog(timeouts={'checkout': 10})
+
+        assert watchdog.run('checkout', ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
+                            cwd=str(tmp_path / 'repo')) == 'master'
+        with pytest.raises(GitCommandError):
+            watchdog.run('checkout', ['git', 'checkout', 'no-exist'], cwd=str(tmp_path / 'repo'))
+
+    def test_phase_timeout(self, tmp_path, stalled_url):
+        url, remote = stalled_url
+        watchdog = GitWatchdog(timeouts={'clone': 1})
+        start = time.time()
+
+        with pytest.raises(GitTimeout):
+            watchdog.run('clone', ['git', 'clone', '--progress', url, str(tmp_path / 'clone')])
+        assert time.time() - start < 5
+
+    def test_stall_timeout_and_retries(self, tmp_path, stalled_url):
+        url, remote = stalled_url
+        travis_repo = TravisRepoAction(url,
+                                        path=str(tmp_path / 'clone'),
+                                        watchdog=GitWatchdog(stall_timeout=0.5, retries=1))
+        start = time.time()
+
+        with pytest.raises(GitTimeout):
+            travis_repo.clone_from(url)
+        assert time.time() - start < 5
+        # One request for each try
+        assert remote.requests == 2
+
+    def test_silent_command_not_stalled(self):
+        import sys
+
+        watchdog = GitWatchdog(stall_timeout=0.5)
+        # Without '--progress' the command writes nothing while it works
+        assert watchdog.run('merge', [sys.executable, '-c', 'import time; time.sleep(1.5); print("done")']) == 'done'
+
+    def test_timeout_raised_by_clone(self, tmp_path, stalled_url):
+        url, remote = stalled_url
+
+        with pytest.raises(GitTimeout):
+            TravisRepoAction(url,
+                            path=str(tmp_path / 'clone'),
+                            clone_repo=True,
+                            target_branch='master',
+                            watchdog=GitWatchdog(timeouts={'clone': 1}))
+
+    def replay_with_hook(self, tmp_path, monkeypatch, hook, phase):
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        origin.git.checkout('-b', 'feature/1')
+        commit_files(origin, {'b.txt': 'b\n'}, 'Add b')
+        origin.git.checkout('master')
+        commit_files(origin, {'c.txt': 'c\n'}, 'Add c')
+        entry = {'target': origin.commit('master').hexsha, 'target_ref': 'master',
+                'origin': origin.commit('feature/1').hexsha, 'merge_tree': None}
+
+        # The replayed repository is created by replay, so the hook is set globally
+        global_config = str(tmp_path / 'gitconfig')
+        with open(global_config, 'w') as f:
+            f.write('[core]\n\thooksPath = {}\n'.format(tmp_path / 'hooks'))
+        write_hook(str(tmp_path / 'hooks'), hook, 'sleep 10')
+        monkeypatch.setenv('GIT_CONFIG_GLOBAL', global_config)
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir, path=str(tmp_path / 'replay'),
+                                        watchdog=GitWatchdog(timeouts={phase: 0.5}))
+        start = time.time()
+        with pytest.raises(GitTimeout):
+            travis_repo.replay(entry)
+        assert time.time() - start < 5
+
+    def test_timeout_raised_by_merge(self, tmp_path, monkeypatch):
+        self.replay_with_hook(tmp_path, monkeypatch, 'prepare-commit-msg', 'merge')
+
+    def test_timeout_raised_by_checkout(self, tmp_path, monkeypatch):
+        self.replay_with_hook(tmp_path, monkeypatch, 'post-checkout', 'checkout')
+
+    def test_parse_timeout(self):
+        data = get_parse_args([URL_GEPPETTO, '--timeout', 'clone=600', '--timeout', 'merge=30'])
+        assert dict(data.timeouts) == {'clone': 600, 'merge': 30}
+
+        with pytest.raises(SystemExit):
+            get_parse_args([URL_GEPPETTO, '--timeout', 'push=10'])
+
+#4 Test
+class TestEventLog():
+
+    class Stream():
+        def __init__(self, tty=False):
+            self.tty = tty
+            self.writes = []
+
+        def isatty(self):
+            return self.tty
+
+        def write(self, text):
+            self.writes.append(text)
+
+        def flush(self):
+            pass
+
+    def test_text_buffered_without_colors(self):
+        stream = self.Stream()
+        log = EventLog(stream=stream)
+
+        log.write('first', color='GREEN')
+        log.write('second')
+        log.write('hidden', level='DEBUG')
+        assert stream.writes == []
+
+        log.flush()
+        assert stream.writes == ['first\nsecond\n']
+
+    def test_text_tty_colors(self):
+        stream = self.Stream(tty=True)
+        log = EventLog(stream=stream)
+
+        log.write('ok', color='GREEN')
+        assert stream.writes == [EventLog.COLORS['GREEN'] + 'ok' + EventLog.COLORS['DEFAULT'] + '\n']
+
+    def test_json_phase_events(self):
+        import json
+
+        stream = self.Stream()
+        log = EventLog(stream=stream, log_format='json')
+
+        log.write('chatter')
+        with log.phase('checkout', repo=URL_GEPPETTO, ref='development') as event:
+            event['sha'] = 'abc'
+        with pytest.raises(MergeError):
+            with log.phase('merge', repo=URL_GEPPETTO, ref='feature/1'):
+                raise MergeError('conflict')
+        log.write('failed', level='ERROR')
+
+        events = [json.loads(line) for line in ''.join(stream.writes).splitlines()]
+        assert [(e['event'], e.get('phase'), e.get('status')) for e in events] == [
+            ('phase', 'checkout', 'ok'), ('phase', 'merge', 'error'), ('message', None, None)]
+        assert events[0]['repo'] == URL_GEPPETTO
+        assert events[0]['ref'] == 'development'
+        assert events[0]['sha'] == 'abc'
+        assert events[0]['duration'] >= 0
+        assert events[1]['error'] == 'conflict'
+        assert events[2]['message'] == 'failed'
+
+    def test_travis_repo_action_events(self, tmp_path, monkeypatch):
+        import json
+
+        stream = self.Stream()
+        monkeypatch.setattr(LOG, 'stream', stream)
+        monkeypatch.setattr(LOG, 'log_format', 'json')
+        origin = make_local_repo(str(tmp_path / 'origin'))
+        origin.git.checkout('-b', 'development')
+        commit_files(origin, {'b.txt': 'b\n'}, 'Add b')
+        origin.git.checkout('master')
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='development')
+        travis_repo.run()
+        LOG.flush()
+
+        events = [json.loads(line) for line in ''.join(stream.writes).splitlines()]
+        assert [e['phase'] for e in events] == ['clone', 'checkout']
+        assert events[1]['ref'] == 'development'
+        assert events[1]['sha'] == origin.commit('development').hexsha
+        assert events[1]['files'] == 1
+
+#4 Test
+class TestPrefetch():
+
+    def make_origin(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'), {'a.txt': 'a\n'})
+        origin.git.checkout('-b', 'development')
+        commit_files(origin, {'b.txt': 'b\n'}, 'Add b')
+        origin.git.checkout('-b', 'feature/1')
+        commit_files(origin, {'c.txt': 'c\n'}, 'Add c')
+        origin.git.checkout('master')
+        return origin
+
+    def test_prefetch_repository(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        store = str(tmp_path / 'store')
+
+        refs = prefetch_repository(origin.working_tree_dir, store, ['development', 'missing', 'master'],
+                                    default_branch='master')
+
+        assert refs == {'refs/heads/development': origin.commit('development').hexsha,
+                        'refs/heads/master': origin.commit('master').hexsha}
+        repo_dir, marker_path, lock_path = get_prefetch_paths(origin.working_tree_dir, store)
+        assert Repo(repo_dir).git.symbolic_ref('HEAD') == 'refs/heads/master'
+        with open(marker_path) as f:
+            marker = json.load(f)
+        assert marker['state'] == 'complete'
+        assert marker['branches'] == ['development', 'master', 'missing']
+
+        # Only the refs of the last prefetch are kept
+        prefetch_repository(origin.working_tree_dir, store, ['feature/1'])
+        assert Repo(repo_dir).git.for_each_ref('--format=%(refname)') == 'refs/heads/feature/1'
+
+    def test_clone_from_prefetch_without_network(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        url = origin.working_tree_dir
+        store = str(tmp_path / 'store')
+        prefetch_repository(url, store, ['development', 'feature/1', 'master'], default_branch='master')
+        # The remote is no longer reachable
+        shutil.move(url, str(tmp_path / 'moved'))
+
+        travis_repo = TravisRepoAction(url,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='development',
+                                        origin_branch='feature/1',
+                                        action_type='pr',
+                                        prefetch_store=store)
+
+        assert 'clone: from ' + get_prefetch_paths(url, store)[0] in travis_repo.repo.git.reflog()
+        assert travis_repo.repo.git.config('remote.origin.url') == url
+        assert travis_repo.pr()
+        assert os.path.exists(str(tmp_path / 'clone' / 'c.txt'))
+
+    def test_prefetch_not_covering_fallback(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        store = str(tmp_path / 'store')
+        prefetch_repository(origin.working_tree_dir, store, ['development', 'master'])
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='development',
+                                        origin_branch='feature/1',
+                                        action_type='pr',
+                                        prefetch_store=store)
+
+        assert travis_repo.find_prefetched() is None
+        assert 'clone: from ' + origin.working_tree_dir in travis_repo.repo.git.reflog()
+
+    def test_prefetch_command_background(self, tmp_path, monkeypatch):
+        origin = self.make_origin(tmp_path)
+        store = str(tmp_path / 'store')
+        monkeypatch.chdir(str(tmp_path))
+
+        prefetch([origin.working_tree_dir, '-t', 'development', '--prefetch-store', store, '--background'])
+
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='development',
+                                        prefetch_store=store)
+
+        # The clone waits for the background prefetch
+        assert travis_repo.find_prefetched() == get_prefetch_paths(origin.working_tree_dir, store)[0]
+        assert 'clone: from ' + get_prefetch_paths(origin.working_tree_dir, store)[0] in travis_repo.repo.git.reflog()
+
+#7 Test
+class TestTravisRepoActionMultiMerge():
+
+    def make_origin(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'), {'a.txt': 'a\n'})
+        for branch, files in [('feature/1', {'b.txt': 'b\n'}),
+                                ('feature/2', {'c.txt': 'c\n'}),
+                                ('feature/3', {'b.txt': 'conflict\n'})]:
+            origin.git.checkout('-b', branch, 'master')
+            commit_files(origin, files, 'Change ' + branch)
+        origin.git.checkout('master')
+        return origin
+
+    def clone(self, origin, tmp_path, origin_branch, **kwargs):
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'clone'),
+                                        clone_repo=True,
+                                        target_branch='master',
+                                        origin_branch=origin_branch,
+                                        action_type='pr',
+                                        **kwargs)
+        travis_repo.set_credentials()
+        return travis_repo
+
+    def test_parse_origin_branches(self):
+        data = get_parse_args(['-o', 'feature/1', URL_GEPPETTO])
+        assert (data.origin, data.url) == ('feature/1', URL_GEPPETTO)
+
+        data = get_parse_args([URL_GEPPETTO, '-o', 'feature/1', '-o', 'feature/2', '--octopus'])
+        assert data.origin == ['feature/1', 'feature/2']
+        assert data.octopus
+
+    def test_merge_in_order(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = self.clone(origin, tmp_path, ['feature/1', 'no-exist', 'feature/2'])
+
+        assert travis_repo.pr()
+        assert [(r['branch'], r['status']) for r in travis_repo.merge_results] == [
+            ('feature/1', 'merged'), ('no-exist', 'missing'), ('feature/2', 'merged')]
+        assert travis_repo.resolved_commits['origin'] == [
+            origin.commit('feature/1').hexsha, None, origin.commit('feature/2').hexsha]
+        assert travis_repo.stats['merge']['files'] == 2
+        assert sorted(os.listdir(str(tmp_path / 'clone'))) == ['.git', 'a.txt', 'b.txt', 'c.txt']
+
+    def test_octopus_merge(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = self.clone(origin, tmp_path, ['feature/1', 'feature/2'], octopus=True)
+
+        assert travis_repo.pr()
+        assert [p.hexsha for p in travis_repo.repo.head.commit.parents] == [
+            origin.commit('master').hexsha, origin.commit('feature/1').hexsha, origin.commit('feature/2').hexsha]
+
+    def test_merge_conflict_details(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = self.clone(origin, tmp_path, ['feature/1', 'feature/3', 'feature/2'])
+
+        with pytest.raises(MergeError) as error:
+            travis_repo.pr()
+
+        assert [(r['branch'], r['status']) for r in error.value.details] == [
+            ('feature/1', 'merged'), ('feature/3', 'conflict'), ('feature/2', 'merged')]
+        assert error.value.details[1]['files'] == ['b.txt']
+        assert str(error.value).startswith('feature/3: ')
+        # The conflicting merge was aborted
+        assert not travis_repo.repo.is_dirty()
+
+    def test_octopus_conflict_details(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = self.clone(origin, tmp_path, ['feature/1', 'feature/2', 'feature/3'], octopus=True)
+
+        with pytest.raises(MergeError) as error:
+            travis_repo.pr()
+
+        assert [r['status'] for r in error.value.details] == ['merged', 'merged', 'conflict']
+        assert error.value.details[2]['files'] == ['b.txt']
+        assert travis_repo.repo.head.commit.hexsha == origin.commit('master').hexsha
+
+    def test_merge_timeout(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        # The merges are not fast-forward, so the hook runs
+        commit_files(origin, {'d.txt': 'd\n'}, 'Add d')
+        travis_repo = self.clone(origin, tmp_path, ['feature/1', 'feature/2'], octopus=True,
+                                watchdog=GitWatchdog(timeouts={'merge': 0.5}))
+        write_hook(os.path.join(travis_repo.repo.git_dir, 'hooks'), 'prepare-commit-msg', 'sleep 10')
+        start = time.time()
+
+        with pytest.raises(GitTimeout):
+            travis_repo.pr()
+        # Not merged again one by one after the octopus merge
+        assert time.time() - start < 3
+
+        travis_repo.octopus = False
+        with pytest.raises(GitTimeout):
+            travis_repo.pr()
+
+    def test_replay_multi_merge(self, tmp_path):
+        origin = self.make_origin(tmp_path)
+        travis_repo = self.clone(origin, tmp_path, ['feature/1', 'feature/2'], octopus=True)
+        travis_repo.run()
+        entry = travis_repo.get_lock_entry()
+
+        replayed = TravisRepoAction(origin.working_tree_dir, path=str(tmp_path / 'replay'))
+        replayed.replay(entry)
+
+        assert entry['octopus']
+        assert replayed.repo.head.commit.tree.hexsha == entry['merge_tree']
+        assert len(replayed.repo.head.commit.parents) == 3
+
+#4 Test
+class TestCopyTree():
+
+    def make_tree(self, path):
+        os.makedirs(os.path.join(path, 'src', 'pkg'))
+        for name in ['README.md', 'src/a.py', 'src/pkg/b.py']:
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(name + '\n')
+        os.chmod(os.path.join(path, 'src', 'a.py'), 0o755)
+        os.symlink('src/a.py', os.path.join(path, 'link.py'))
+        return path
+
+    def assert_same_tree(self, source, dest):
+        for name in ['README.md', 'src/a.py', 'src/pkg/b.py']:
+            with open(os.path.join(dest, name)) as f:
+                assert f.read() == name + '\n'
+        assert os.stat(os.path.join(dest, 'src', 'a.py')).st_mode & 0o777 == 0o755
+        assert os.readlink(os.path.join(dest, 'link.py')) == 'src/a.py'
+
+    def test_copy_tree_auto(self, tmp_path):
+        source = self.make_tree(str(tmp_path / 'source'))
+
+        result = copy_tree(source, str(tmp_path / 'dest'))
+
+        assert result['strategy'] in ('reflink', 'copy')
+        assert result['files'] == 3
+        self.assert_same_tree(source, str(tmp_path / 'dest'))
+        assert not os.path.samefile(os.path.join(source, 'README.md'), str(tmp_path / 'dest' / 'README.md'))
+
+    def test_copy_tree_hardlink(self, tmp_path):
+        source = self.make_tree(str(tmp_path / 'source'))
+
+        result = copy_tree(source, str(tmp_path / 'dest'), mode='hardlink', workers=2)
+
+        assert result == {'strategy': 'hardlink', 'files': 3}
+        self.assert_same_tree(source, str(tmp_path / 'dest'))
+        assert os.path.samefile(os.path.join(source, 'src', 'pkg', 'b.py'), str(tmp_path / 'dest' / 'src' / 'pkg' / 'b.py'))
+
+    def test_copy_tree_fallback(self, tmp_path, monkeypatch):
+        import errno
+
+        def link(source, dest):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        monkeypatch.setattr(os, 'link', link)
+        source = self.make_tree(str(tmp_path / 'source'))
+
+        result = copy_tree(source, str(tmp_path / 'dest'), mode='hardlink')
+
+        assert result == {'strategy': 'copy', 'files': 3}
+        self.assert_same_tree(source, str(tmp_path / 'dest'))
+
+    def test_materialize(self, tmp_path):
+        origin = make_local_repo(str(tmp_path / 'origin'), {'a.txt': 'a\n', 'dir/b.txt': 'b\n'})
+        travis_repo = TravisRepoAction(origin.working_tree_dir,
+                                        path=str(tmp_path / 'dest1'),
+                                        clone_repo=True,
+                                        target_branch='master')
+        travis_repo.run()
+        travis_repo.del_git_file()
+        os.makedirs(str(tmp_path / 'dest3' / 'old'))
+
+        results = travis_repo.materialize([str(tmp_path / 'dest2'), str(tmp_path / 'dest3')], mode='hardlink')
+
+        assert [(r['dest'], r['strategy'], r['files']) for r in results] == [
+            (str(tmp_path / 'dest2'), 'hardlink', 2), (str(tmp_path / 'dest3'), 'hardlink', 2)]
+        assert travis_repo.stats['materialize']['files'] == 4
+        for dest in ['dest2', 'dest3']:
+            assert sorted(os.listdir(str(tmp_path / dest))) == ['a.txt', 'dir']
+
+#4 Test
+class TestStandInRemote():
+
+    def make_origin(self, remote):
+        origin = make_local_repo(os.path.join(remote.root, 'origin'), {'a.txt': 'a\n'})
+        origin.git.checkout('-b', 'development')
+        # Incompressible content, so the transfer size is known
+        commit_files(origin, {'data.bin': ''.join(random.choice('0123456789abcdef') for _ in range(200000))},
+                    'Add data')
+        origin.git.checkout('master')
+        return origin
+
+    def clone(self, remote, tmp_path, **kwargs):
+        return TravisRepoAction(remote.url('origin'),
+                                path=str(tmp_path / 'clone'),
+                                clone_repo=True,
+                                target_branch='development',
+                                **kwargs)
+
+    def test_clone_and_merge(self, tmp_path, stand_in_remote):
+        origin = self.make_origin(stand_in_remote)
+        origin.git.checkout('-b', 'feature/1')
+        commit_files(origin, {'b.txt': 'b\n'}, 'Add b')
+        origin.git.checkout('master')
+
+        travis_repo = self.clone(stand_in_remote, tmp_path, origin_branch='feature/1', action_type='pr')
+        travis_repo.set_credentials()
+
+        assert travis_repo.pr()
+        assert travis_repo.repo.git.config('remote.origin.url') == stand_in_remote.url('origin')
+        assert sorted(os.listdir(str(tmp_path / 'clone'))) == ['.git', 'a.txt', 'b.txt', 'data.bin']
+        assert stand_in_remote.requests >= 2
+
+    def test_latency_and_bandwidth(self, tmp_path, stand_in_remote):
+        self.make_origin(stand_in_remote)
+        stand_in_remote.latency = 0.2
+        stand_in_remote.bandwidth = 200000
+        start = time.time()
+
+        self.clone(stand_in_remote, tmp_path)
+
+        # A round trip for each request, and the pack of about 100KB compressed
+        assert time.time() - start >= stand_in_remote.requests * 0.2 + stand_in_remote.bytes_sent / 200000.0 * 0.9
+        assert stand_in_remote.bytes_sent > 100000
+
+    def test_reset(self, tmp_path, stand_in_remote):
+        self.make_origin(stand_in_remote)
+        stand_in_remote.reset_after = 100
+        stand_in_remote.faults = 1
+        travis_repo = TravisRepoAction(stand_in_remote.url('origin'), path=str(tmp_path / 'clone'))
+
+        with pytest.raises(GitCommandError):
+            travis_repo.clone_from(stand_in_remote.url('origin'))
+
+        # Only one response is reset
+        shutil.rmtree(str(tmp_path / 'clone'), ignore_errors=True)
+        travis_repo.clone_from(stand_in_remote.url('origin'))
+        assert travis_repo.is_repo_branch('development')
+
+    def test_stall_retried_with_new_connection(self, tmp_path, stand_in_remote):
+        origin = self.make_origin(stand_in_remote)
+        # The pack is the only response longer than 50000 bytes
+        stand_in_remote.stall_after = 50000
+        stand_in_remote.faults = 1
+
+        travis_repo = self.clone(stand_in_remote, tmp_path, watchdog=GitWatchdog(stall_timeout=1, retries=1))
+
+        assert travis_repo.push()
+        assert travis_repo.repo.head.commit.hexsha == origin.commit('development').hexsha
+        assert stand_in_remote.faults == 0